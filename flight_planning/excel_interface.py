@@ -2,17 +2,470 @@
 # Copyright 2015 Samuel LeBlanc
 
 import numpy as np
-from xlwings import Range
 import Pysolar.solar as sol
 from datetime import datetime
-from scipy import interpolate
 import write_utils as wu
 
 import map_interactive as mi
 from map_interactive import pll
 import map_utils as mu
 
-class dict_position:
+class column_store(object):
+    """
+    Purpose:
+        Storage of the flight plan values in a single numpy structured array, with one float field per value.
+        The capacity is doubled when full, so appending a point is amortized O(1),
+        and deleting or inserting a point at index i only moves the points after i, in place.
+    Inputs: (at init)
+        names: list of the field names
+        capacity: (optional, defaults to 16) number of rows initially allocated
+    Outputs:
+        column_store class, with n the number of points in use
+    Dependencies:
+        numpy
+    Example:
+        ...
+    """
+    def __init__(self,names,capacity=16):
+        self.names = list(names)
+        self.n = 0
+        self.data = np.zeros(capacity,dtype=[(s,float) for s in self.names])
+        self.clear(0,capacity)
+
+    def clear(self,i0,i1):
+        'Program to set the rows from i0 to i1 to NaN'
+        for s in self.names:
+            self.data[s][i0:i1] = np.nan
+
+    def column(self,name):
+        'Program to return the view of the field name, for the points in use'
+        return self.data[name][:self.n]
+
+    def reserve(self,n):
+        'Program to make sure there is room for n points, doubles the capacity when needed'
+        capacity = len(self.data)
+        if n<=capacity:
+            return
+        while capacity<n:
+            capacity = capacity*2
+        data = np.zeros(capacity,dtype=self.data.dtype)
+        data[:self.n] = self.data[:self.n]
+        self.data = data
+        self.clear(self.n,capacity)
+
+    def resize(self,n):
+        'Program to change the number of points in use, new points are NaN'
+        self.reserve(n)
+        if n<self.n:
+            self.clear(n,self.n)
+        self.n = n
+
+    def set_row(self,i,values):
+        'Program to fill the row i with the values dict, None or missing values are NaN'
+        self.clear(i,i+1)
+        for k,v in values.items():
+            if v is not None:
+                self.data[k][i] = v
+
+    def insert(self,i,**values):
+        'Program to insert a point at index i, moving the points after i'
+        self.reserve(self.n+1)
+        self.data[i+1:self.n+1] = self.data[i:self.n].copy()
+        self.set_row(i,values)
+        self.n = self.n+1
+
+    def append(self,**values):
+        'Program to append a point at the end'
+        self.insert(self.n,**values)
+
+    def delete(self,i):
+        'Program to remove the point at index i, moving the points after i'
+        self.data[i:self.n-1] = self.data[i+1:self.n].copy()
+        self.n = self.n-1
+        self.clear(self.n,self.n+1)
+
+class column_view(object):
+    """
+    Descriptor that links an attribute of dict_position to a field of its column_store (self.store)
+    Reading returns a numpy view of the points in use, 
+    writing copies the values in the store, changing the number of points if needed
+    """
+    def __init__(self,name):
+        self.name = name
+
+    def __get__(self,obj,objtype=None):
+        if obj is None:
+            return self
+        return obj.store.column(self.name)
+
+    def __set__(self,obj,value):
+        value = np.atleast_1d(np.asarray(value,dtype=float))
+        if len(value)!=obj.store.n:
+            obj.store.resize(len(value))
+        obj.store.column(self.name)[:] = value
+
+def xl_range(address):
+    """
+    Program to convert an excel address (like 'A2', 'A2:U30' or 'B:B') to the 1-based indices (r0,c0,r1,c1)
+    Full column addresses return None for the rows
+    """
+    import re
+    def col(s):
+        c = 0
+        for ch in s:
+            c = c*26+ord(ch)-ord('A')+1
+        return c
+    cells = []
+    for a in address.upper().split(':'):
+        m = re.match('^([A-Z]+)([0-9]*)$',a)
+        if not m:
+            raise ValueError('Not a valid excel address: %s'%address)
+        cells.append((int(m.group(2)) if m.group(2) else None,col(m.group(1))))
+    if len(cells)==1:
+        cells.append(cells[0])
+    (r0,c0),(r1,c1) = cells
+    if r0 and r1 and r1<r0:
+        r0,r1 = r1,r0
+    return r0,min(c0,c1),r1,max(c0,c1)
+
+class memory_backend(object):
+    """
+    Purpose:
+        Spreadsheet backend of dict_position that keeps the sheets in memory, without excel
+        Same methods as the other backends (xlwings_backend, openpyxl_backend): 
+            create, add_sheet, open, activate, count, sheet_name, read, write, clear, 
+            number_format, autofit, format_header, set_current, save, close
+        Sheet numbers are 1-based, and read/write act on the active sheet, like in excel
+    Inputs: (at init)
+        none
+    Outputs:
+        memory_backend class, to be passed as the backend keyword of dict_position 
+        (share the same instance to put multiple flights in the same workbook)
+    Dependencies:
+        none
+    Example:
+        wb = memory_backend()
+        ex = dict_position(backend=wb)
+    """
+    interactive = False
+
+    def __init__(self):
+        self.names = []
+        self.sheets = []
+        self.active = 1
+        self.filename = None
+
+    def create(self,name):
+        'Program to start a new workbook with a single sheet'
+        self.names,self.sheets = [],[]
+        self.add_sheet(name)
+
+    def add_sheet(self,name):
+        'Program to add a new sheet at the end and activate it'
+        self.names.append(name)
+        self.sheets.append({})
+        self.active = len(self.names)
+
+    def open(self,filename):
+        'Program to open a workbook, the memory backend only reopens its own'
+        if filename!=self.filename:
+            raise IOError('memory backend can not open the file: %s'%filename)
+
+    def activate(self,sheet_num):
+        'Program to activate the sheet number sheet_num'
+        self.active = sheet_num
+
+    def count(self):
+        'Program to return the number of sheets'
+        return len(self.names)
+
+    def sheet_name(self,sheet_num=None):
+        'Program to return the name of the sheet_num sheet, defaults to the active one'
+        return self.names[(sheet_num or self.active)-1]
+
+    def get_cell(self,r,c):
+        'Program to return the value of a single cell of the active sheet'
+        return self.sheets[self.active-1].get((r,c))
+
+    def set_cell(self,r,c,v):
+        'Program to set the value of a single cell of the active sheet, None empties the cell'
+        if v is None or v=='':
+            self.sheets[self.active-1].pop((r,c),None)
+        else:
+            self.sheets[self.active-1][(r,c)] = v
+
+    def read(self,address):
+        'Program to read the values of the address, returns a single value for one cell, or a list of rows'
+        r0,c0,r1,c1 = xl_range(address)
+        if r0==r1 and c0==c1:
+            return self.get_cell(r0,c0)
+        return [[self.get_cell(r,c) for c in range(c0,c1+1)] for r in range(r0,r1+1)]
+
+    def write(self,address,value):
+        'Program to write a single value, a row (list) or a list of rows starting at the top left of address'
+        import numpy as np
+        r0,c0,_,_ = xl_range(address)
+        if isinstance(value,np.ndarray):
+            value = value.tolist()
+        if not isinstance(value,(list,tuple)):
+            value = [[value]]
+        elif not len(value) or not isinstance(value[0],(list,tuple)):
+            value = [value]
+        for i,row in enumerate(value):
+            for j,v in enumerate(row):
+                if isinstance(v,np.generic):
+                    v = v.item()
+                if isinstance(v,float) and not np.isfinite(v):
+                    v = None
+                self.set_cell(r0+i,c0+j,v)
+
+    def clear(self,address):
+        'Program to empty the cells of address'
+        r0,c0,r1,c1 = xl_range(address)
+        for r in range(r0,r1+1):
+            for c in range(c0,c1+1):
+                self.set_cell(r,c,None)
+
+    def number_format(self,address,fmt):
+        'Program to set the number format of the cells, no formatting in memory'
+        pass
+
+    def autofit(self,address):
+        'Program to autofit the columns, no formatting in memory'
+        pass
+
+    def format_header(self,address):
+        'Program to format the header line, no formatting in memory'
+        pass
+
+    def set_current(self):
+        'Program to make this workbook the current one, nothing to do in memory'
+        pass
+
+    def save(self,filename=None):
+        'Program to save the workbook, not possible in memory'
+        print '** memory backend, workbook not saved **'
+
+    def close(self):
+        'Program to close the workbook'
+        pass
+
+class openpyxl_backend(memory_backend):
+    """
+    Purpose:
+        Spreadsheet backend of dict_position that reads and writes xlsx files with openpyxl, without excel
+        Same methods as memory_backend, the workbook is written to file on save
+    Inputs: (at init)
+        filename: (optional) default xlsx file to save to
+    Outputs:
+        openpyxl_backend class, to be passed as the backend keyword of dict_position
+    Dependencies:
+        openpyxl
+    Example:
+        wb = openpyxl_backend('flight.xlsx')
+        ex = dict_position(backend=wb)
+        ex.save2xl()
+    """
+    def __init__(self,filename=None):
+        import openpyxl
+        self.book = openpyxl.Workbook()
+        self.active = 1
+        self.filename = filename
+        self.names = []
+
+    def create(self,name):
+        'Program to start a new workbook with a single sheet'
+        import openpyxl
+        self.book = openpyxl.Workbook()
+        self.book.active.title = name
+        self.names = [name]
+        self.active = 1
+
+    def add_sheet(self,name):
+        'Program to add a new sheet at the end and activate it'
+        self.book.create_sheet(title=name)
+        self.names = self.book.sheetnames
+        self.active = len(self.names)
+
+    def open(self,filename):
+        'Program to load the xlsx file, unless already loaded'
+        import openpyxl
+        if filename==self.filename and self.names:
+            return
+        self.book = openpyxl.load_workbook(filename)
+        self.names = self.book.sheetnames
+        self.filename = filename
+
+    def get_cell(self,r,c):
+        'Program to return the value of a single cell of the active sheet, times are returned as excel day fractions'
+        import datetime
+        v = self.book.worksheets[self.active-1].cell(row=r,column=c).value
+        if isinstance(v,datetime.datetime):
+            v = (v-datetime.datetime(1899,12,30)).total_seconds()/86400.0
+        elif isinstance(v,datetime.time):
+            v = (v.hour*3600.0+v.minute*60.0+v.second+v.microsecond/1.0E6)/86400.0
+        elif isinstance(v,datetime.timedelta):
+            v = v.total_seconds()/86400.0
+        return v
+
+    def set_cell(self,r,c,v):
+        'Program to set the value of a single cell of the active sheet, None empties the cell'
+        self.book.worksheets[self.active-1].cell(row=r,column=c).value = None if v=='' else v
+
+    def number_format(self,address,fmt):
+        'Program to set the number format of the cells'
+        r0,c0,r1,c1 = xl_range(address)
+        ws = self.book.worksheets[self.active-1]
+        for r in range(r0 or 1,(r1 or ws.max_row)+1):
+            for c in range(c0,c1+1):
+                ws.cell(row=r,column=c).number_format = fmt
+
+    def format_header(self,address):
+        'Program to set the header line in bold, and keep it visible'
+        from openpyxl.styles import Font
+        r0,c0,r1,c1 = xl_range(address)
+        ws = self.book.worksheets[self.active-1]
+        for c in range(c0,c1+1):
+            ws.cell(row=r0,column=c).font = Font(bold=True)
+        ws.freeze_panes = 'A%i'%(r0+1)
+
+    def save(self,filename=None):
+        'Program to save the workbook to the xlsx file'
+        if filename:
+            self.filename = filename
+        if not self.filename:
+            print '** no filename selected, returning without saving **'
+            return
+        self.book.save(self.filename)
+
+class xlwings_backend(object):
+    """
+    Purpose:
+        Spreadsheet backend of dict_position linked to a live excel workbook through xlwings
+        Same methods as memory_backend
+    Inputs: (at init)
+        none
+    Outputs:
+        xlwings_backend class
+    Dependencies:
+        xlwings
+        Excel (win or mac)
+    Example:
+        ex = dict_position(backend='xlwings')
+    """
+    interactive = True
+
+    def __init__(self):
+        self.book = None
+
+    def create(self,name):
+        'Program to start a new workbook with a single sheet'
+        from xlwings import Workbook, Sheet
+        self.book = Workbook()
+        Sheet(1).name = name
+
+    def add_sheet(self,name):
+        'Program to add a new sheet in the current workbook'
+        from xlwings import Workbook, Sheet
+        Sheet(1).add(name=name)
+        self.book = Workbook.current()
+
+    def open(self,filename):
+        'Program to open the excel file'
+        from xlwings import Workbook
+        self.book = Workbook(filename)
+
+    def activate(self,sheet_num):
+        'Program to activate the sheet number sheet_num'
+        from xlwings import Sheet
+        Sheet(sheet_num).activate()
+
+    def count(self):
+        'Program to return the number of sheets'
+        from xlwings import Sheet
+        return Sheet.count()
+
+    def sheet_name(self,sheet_num=None):
+        'Program to return the name of the sheet_num sheet, defaults to the active one'
+        from xlwings import Sheet
+        if sheet_num:
+            return Sheet(sheet_num).name
+        return Sheet.active().name
+
+    def read(self,address):
+        'Program to read the values of the address, returns a single value for one cell, or a list of rows'
+        from xlwings import Range
+        r0,c0,r1,c1 = xl_range(address)
+        v = Range(address).value
+        if r0==r1 and c0==c1:
+            return v
+        if r0==r1:
+            return [v]
+        if c0==c1:
+            return [[u] for u in v]
+        return v
+
+    def write(self,address,value):
+        'Program to write a single value, a row (list) or a list of rows starting at the top left of address'
+        from xlwings import Range
+        Range(address).value = value
+
+    def clear(self,address):
+        'Program to empty the cells of address'
+        from xlwings import Range
+        Range(address).clear_contents()
+
+    def number_format(self,address,fmt):
+        'Program to set the number format of the cells'
+        from xlwings import Range
+        Range(address).number_format = fmt
+
+    def autofit(self,address):
+        'Program to autofit the columns'
+        from xlwings import Range
+        Range(address).autofit('c')
+
+    def format_header(self,address):
+        'Program to set the header line in bold, and keep it visible'
+        from xlwings import Range
+        top_line = Range(address)
+        from sys import platform
+        if platform.startswith('win'):
+            from win32com.client import Dispatch
+            xl = Dispatch("Excel.Application")
+         #   xl.ActiveWorkbook.Windows(1).SplitColumn = 0.4
+            xl.ActiveWorkbook.Windows(1).SplitRow = 1.0
+            xl.Range(top_line.get_address(False,False)).Font.Bold = True
+        top_line.autofit()
+
+    def set_current(self):
+        'Program to make this workbook the current one'
+        self.book.set_current()
+
+    def save(self,filename=None):
+        'Program to save the workbook, same as the save button in excel'
+        self.book.save(filename)
+
+    def close(self):
+        'Program to close the workbook'
+        self.book.close()
+
+backends = {'xlwings':xlwings_backend,'memory':memory_backend,'openpyxl':openpyxl_backend}
+
+def get_backend(backend='xlwings'):
+    """
+    Program to return the spreadsheet backend instance
+    backend can be an instance already in use (for multiple flights in the same workbook) 
+    or the name of a new one: 'xlwings', 'memory' or 'openpyxl'
+    """
+    if isinstance(backend,basestring):
+        try:
+            return backends[backend]()
+        except KeyError:
+            raise ValueError('Unknown spreadsheet backend: %s, use one of: %s'%(backend,', '.join(backends.keys())))
+    return backend
+
+class dict_position(object):
     """
     Purpose:
         Class that creates an easy storage for position coordinates.
@@ -32,12 +485,13 @@ class dict_position:
         color: (optional) the color of the flight path defaults to red.
         sheet_num: (optional, defaults to 1) the sheet number to switch to
         profile: (optional) if set, uses a dict of basemap profile to set for the initial lat lons, alt, utc_start, utc_conversion, name
+        backend: (optional) spreadsheet backend, 'xlwings' (default, live Excel), 'openpyxl' (xlsx file) or 'memory' (no file),
+                 or a backend instance to add the flight to the same workbook
     Outputs:
         dict_position class 
     Dependencies:
         numpy
-        xlwings
-        Excel (win or mac)
+        xlwings and Excel (win or mac), or openpyxl, depending on the backend
         map_interactive
         map_utils
         simplekml
@@ -71,9 +525,9 @@ class dict_position:
 	        - added init codes for loading a single sheet of a workbook
 	Modified: Samuel LeBlanc, 2015-09-15, NASA Ames, CA
                 - added handling of the profile dict of lat lon and starting positions
+        Modified: added the backend keyword, to run without Excel
     """
     import numpy as np
-    from xlwings import Range,Sheet
     import Pysolar.solar as sol
     from datetime import datetime
 
@@ -81,17 +535,51 @@ class dict_position:
     from map_interactive import pll
     import map_utils as mu
 
+    # values of each waypoint, saved in a single column_store
+    columns = ['lat','lon','speed','delayt','alt','alt_kft','speed_kts','cumlegt','utc','local',
+               'legt','dist','cumdist','dist_nm','cumdist_nm','bearing','endbearing',
+               'turn_deg','turn_time','climb_time','sza','azi']
+    lat = column_view('lat')
+    lon = column_view('lon')
+    speed = column_view('speed')
+    delayt = column_view('delayt')
+    alt = column_view('alt')
+    alt_kft = column_view('alt_kft')
+    speed_kts = column_view('speed_kts')
+    cumlegt = column_view('cumlegt')
+    utc = column_view('utc')
+    UTC = column_view('utc')
+    local = column_view('local')
+    legt = column_view('legt')
+    head = column_view('legt')
+    dist = column_view('dist')
+    cumdist = column_view('cumdist')
+    dist_nm = column_view('dist_nm')
+    cumdist_nm = column_view('cumdist_nm')
+    bearing = column_view('bearing')
+    endbearing = column_view('endbearing')
+    turn_deg = column_view('turn_deg')
+    turn_time = column_view('turn_time')
+    climb_time = column_view('climb_time')
+    sza = column_view('sza')
+    azi = column_view('azi')
+    xl_cols = 'ABCDEFGHIJKLMNOPQRSTU'
+    xl_extra_rows = 20
+
     def __init__(self,lon0='14 38.717E',lat0='22 58.783S',speed=150.0,UTC_start=7.0,
                  UTC_conversion=+1.0,alt0=0.0,
                  verbose=False,filename=None,datestr=None,
                  newsheetonly=False,name='P3 Flight path',sheet_num=1,color='red',
-                 profile=None,campaign='None',version='v0.8beta'):
+                 profile=None,campaign='None',version='v0.8beta',backend='xlwings'):
 
         if profile:
             lon0,lat0,UTC_start = profile['Start_lon'],profile['Start_lat'],profile['UTC_start']
             UTC_conversion,alt0,name,campaign = profile['UTC_conversion'],profile['start_alt'],profile['Plane_name'],profile['Campaign']
         self.__version__ = version
+        self.store = column_store(self.columns)
         self.comments = [' ']
+        self.xl_shadow = None
+        self.backend = backend
         self.lon = np.array([pll(lon0)])
         self.lat = np.array([pll(lat0)])
         self.speed = np.array([speed])
@@ -111,10 +599,12 @@ class dict_position:
         self.climb_time = self.lon*0.0
         self.sza = self.lon*0.0
         self.azi = self.lon*0.0
-        self.datetime = self.lon*0.0
+        self.datetime = [None]
         self.speed_kts = self.speed*1.94384449246
         self.alt_kft = self.alt*3.28084/1000.0
         self.head = self.legt
+        self.i_dirty = 0
+        self.utc_dirty = False
         self.color = color
         self.googleearthopened = False
         self.netkml = None
@@ -165,6 +655,8 @@ class dict_position:
         Fills in the waypoint numbers
 
         Assumes that blank spaces/nan are to be filled with new calculations
+        Only recalculates from the lowest modified waypoint (i_dirty), the points before are kept.
+        If only the starting UTC was changed (utc_dirty), the times are shifted without new geometry
         """
         default_bank_angle = 15.0
         self.rate_of_turn = 1091.0*np.tan(default_bank_angle*np.pi/180)/self.speed[0] # degree per second
@@ -172,46 +664,20 @@ class dict_position:
             self.rate_of_turn = 2.4
         self.n = len(self.lon)
         self.WP = range(1,self.n+1)
-        for i in xrange(self.n-1):
-            self.dist[i+1] = mu.spherical_dist([self.lat[i],self.lon[i]],[self.lat[i+1],self.lon[i+1]])
-            if np.isfinite(self.alt.astype(float)[i+1]):
-                self.alt_kft[i+1] = self.alt[i+1]*3.28084/1000.0
-            elif np.isfinite(self.alt_kft.astype(float)[i+1]):
-                self.alt[i+1] = self.alt_kft[i+1]*1000.0/3.28084
-            else:
-                self.alt[i+1] = self.get_alt(self.alt[0],self.alt[i])
-                self.alt_kft[i+1] = self.alt[i+1]*3.28084/1000.0
-            if np.isfinite(self.speed.astype(float)[i+1]):
-                self.speed_kts[i+1] = self.speed[i+1]*1.94384449246
-            elif np.isfinite(self.speed_kts.astype(float)[i+1]):
-                self.speed[i+1] = self.speed_kts[i+1]/1.94384449246
-            else:
-                self.speed[i+1] = self.calcspeed(self.alt[i],self.alt[i+1])
-                self.speed_kts[i+1] = self.speed[i+1]*1.94384449246  
-            self.bearing[i] = mu.bearing([self.lat[i],self.lon[i]],[self.lat[i+1],self.lon[i+1]])
-            self.endbearing[i] = (mu.bearing([self.lat[i+1],self.lon[i+1]],[self.lat[i],self.lon[i]])+180)%360.0
-            try:
-                self.bearing[i+1] = mu.bearing([self.lat[i+1],self.lon[i+1]],[self.lat[i+2],self.lon[i+2]])
-            except:
-                self.bearing[i+1] = self.endbearing[i]
-            try:
-                self.turn_deg[i+1] = abs(self.endbearing[i]-self.bearing[i+1])
-            except:
-                self.turn_deg[i+1] = 0.0
-            self.turn_time[i+1] = (self.turn_deg[i+1]/self.rate_of_turn)/60.0
-            if not np.isfinite(self.delayt.astype(float)[i+1]):
-                self.delayt[i+1] = self.turn_time[i+1]
-            #else:
-            #    self.delayt[i+1] = self.delayt[i+1]+self.turn_time[i+1]
-            self.climb_time[i+1] = self.calc_climb_time(self.alt[i],self.alt[i+1]) #defaults to P3 speed
-            self.legt[i+1] = (self.dist[i+1]/(self.speed[i+1]/1000.0))/3600.0
-            if self.legt[i+1] < self.climb_time[i+1]/60.0:
-                self.legt[i+1] = self.climb_time[i+1]/60.0
-            self.legt[i+1] += self.delayt[i+1]/60.0
-            self.utc[i+1] = self.utc[i]+self.legt[i+1]
-            if not np.isfinite(self.utc[i+1]):
-                print self.utc
-                import pdb; pdb.set_trace()
+        i0 = min(self.i_dirty,self.n)
+        if i0<self.n:
+            ileg = max(i0-2,0) # first leg to recalculate, the turn at i0-1 depends on the leg i0-1
+        else:
+            ileg = self.n # nothing modified
+        self.calc_legs(ileg)
+        if self.utc_dirty:
+            ileg = 0
+        self.calc_utc(ileg)
+        it = min(ileg+1,i0) # first point with a new time or position
+        if self.utc_dirty:
+            it = 0
+        if not len(self.datetime)==self.n:
+            it = 0
             
         self.local = self.utc+self.UTC_conversion
         self.dist_nm = self.dist*0.53996
@@ -219,46 +685,122 @@ class dict_position:
         self.cumdist_nm = self.dist_nm.cumsum()
         self.cumlegt = np.nan_to_num(self.legt).cumsum()
         
-        self.datetime = self.calcdatetime()
-        self.sza,self.azi = mu.get_sza_azi(self.lat,self.lon,self.datetime)
-        self.azi = [a+360.0 for a in self.azi]
+        if it<self.n:
+            self.datetime = self.datetime[:it]+self.calcdatetime(it)
+            sza,azi = mu.get_sza_azi(self.lat[it:],self.lon[it:],self.utc2datetime64(self.utc[it:]))
+            self.sza[it:] = sza
+            self.azi[it:] = np.array(azi)+360.0
+        self.i_dirty = self.n
+        self.utc_dirty = False
+        self.track_cache = {}
         
         self.time2xl()
 
+    def calc_legs(self,i=0):
+        """
+        Program to calculate the values of every leg at once, with numpy arrays
+        Leg i is the path from waypoint i to waypoint i+1, its values are saved at index i+1
+        Fills the distance, altitude, speed, bearing, end bearing, turn angle, 
+        turn time, delay time, climb time and leg time
+        Only the legs starting from leg i (defaults to 0, all legs) are calculated
+        """
+        if self.n-i<2:
+            return
+        pos0 = np.column_stack((self.lat[i:-1],self.lon[i:-1]))
+        pos1 = np.column_stack((self.lat[i+1:],self.lon[i+1:]))
+        self.dist[i+1:] = mu.spherical_dist(pos0,pos1)
+
+        # altitude, priority given to metric, then kft, then guesstimate from the previous point
+        alt,alt_kft = self.alt[i+1:],self.alt_kft[i+1:]
+        ia = np.isfinite(alt)
+        ik = ~ia & np.isfinite(alt_kft)
+        alt_kft[ia] = alt[ia]*3.28084/1000.0
+        alt[ik] = alt_kft[ik]*1000.0/3.28084
+        self.fill_alt(i)
+
+        # speed, priority given to metric, then kts, then estimate from altitude
+        speed,speed_kts = self.speed[i+1:],self.speed_kts[i+1:]
+        isp = np.isfinite(speed)
+        ik = ~isp & np.isfinite(speed_kts)
+        ic = ~(isp | ik)
+        speed_kts[isp] = speed[isp]*1.94384449246
+        speed[ik] = speed_kts[ik]/1.94384449246
+        speed[ic] = self.calcspeed(self.alt[i:-1],self.alt[i+1:])[ic]
+        speed_kts[ic] = speed[ic]*1.94384449246
+
+        # bearing and turning
+        self.bearing[i:-1] = mu.bearing(pos0,pos1)
+        self.endbearing[i:-1] = (mu.bearing(pos1,pos0)+180)%360.0
+        self.bearing[-1] = self.endbearing[-2]
+        self.turn_deg[i+1:] = abs(self.endbearing[i:-1]-self.bearing[i+1:])
+        self.turn_time[i+1:] = (self.turn_deg[i+1:]/self.rate_of_turn)/60.0
+        delayt = self.delayt[i+1:]
+        idt = ~np.isfinite(delayt)
+        delayt[idt] = self.turn_time[i+1:][idt]
+
+        # time of each leg
+        self.climb_time[i+1:] = self.calc_climb_time(self.alt[i:-1],self.alt[i+1:]) #defaults to P3 speed
+        with np.errstate(invalid='ignore',divide='ignore'):
+            legt = (self.dist[i+1:]/(self.speed[i+1:]/1000.0))/3600.0
+            climbt = self.climb_time[i+1:]/60.0
+            legt = np.where(legt<climbt,climbt,legt)
+        legt += self.delayt[i+1:]/60.0
+        self.legt[i+1:] = legt
+
+    def calc_utc(self,i=0):
+        """
+        Program to calculate the UTC of each waypoint from the leg times
+        The only sequential calculation, the cumulative sum of the leg times
+        Only the UTC after the waypoint i (defaults to 0, the start) are calculated
+        """
+        if i<self.n-1:
+            self.utc[i+1:] = np.cumsum(np.append(self.utc[i],self.legt[i+1:]))[1:]
+        if not all(np.isfinite(self.utc)):
+            print '** Problem: UTC not finite on lines: %s **' %np.where(~np.isfinite(self.utc))[0]
+
+    def fill_alt(self,i=0):
+        """
+        Program to fill the missing altitudes, with the guesstimate of the cruising 
+        altitude from the last defined altitude
+        Only fills the altitudes after the waypoint i (defaults to 0)
+        """
+        alt = self.alt[i:]
+        valid = np.isfinite(alt)
+        valid[0] = True
+        if all(valid):
+            return
+        ilast = np.maximum.accumulate(np.where(valid,np.arange(len(alt)),0))
+        fill = self.get_alt(self.alt[0],alt[ilast])
+        alt[~valid] = fill[~valid]
+        self.alt_kft[i:][~valid] = alt[~valid]*3.28084/1000.0
+
     def calcspeed(self,alt0,alt1):
         """
         Simple program to estimate the speed of the aircraft:
         P3 from Steven Howell based on TRACE-P
         ER2 from Samuel LeBlanc based on SEAC4RS
+        Works on arrays of alt0 and alt1
         """
-        if self.platform=='p3':
-            TAS = 130.0+alt1/1000.0*7.5
-            if alt1>6000.0:
-                TAS = 130.0+6*7.5
-            if alt1>alt0+200.0:
-                TAS = TAS -15.0
-        elif self.platform=='er2':
-            TAS = 70+alt0*0.0071
-        else:
-            TAS = 130.0
-        if not np.isfinite(TAS):
-            TAS = 130.0
+        alt0,alt1 = np.asarray(alt0,dtype=float),np.asarray(alt1,dtype=float)
+        TAS = np.zeros(np.broadcast(alt0,alt1).shape)
+        with np.errstate(invalid='ignore'):
+            if self.platform=='p3':
+                TAS = TAS+130.0+alt1/1000.0*7.5
+                TAS[alt1>6000.0] = 130.0+6*7.5
+                TAS[alt1>alt0+200.0] -= 15.0
+            elif self.platform=='er2':
+                TAS = TAS+70+alt0*0.0071
+            else:
+                TAS = TAS+130.0
+        TAS[~np.isfinite(TAS)] = 130.0
         return TAS
 
     def get_alt(self,alt0,alti):
-        'Program to guesstimate the cruising altitude'
-        if alti!=alt0:
-            return alti
-        if self.platform=='p3':
-            return 7500.0
-        elif self.platform=='er2':
-            return 19000.0
-        elif self.platform=='c130':
-            return 7500.0
-        elif self.platform=='dc8':
-            return 13000.0
-        else:
+        'Program to guesstimate the cruising altitude, works on arrays of alti'
+        cruise = {'p3':7500.0,'er2':19000.0,'c130':7500.0,'dc8':13000.0}
+        if not self.platform in cruise:
             return alti
+        return np.where(alti!=alt0,alti,cruise[self.platform])
         
     def calc_climb_time(self,alt0,alt1):
         """
@@ -266,67 +808,50 @@ class dict_position:
         Uses parameterization for P3 and ER2 for now.
         Default parameters are used when nothing is set.
         Uses altitude from previous point (alt0) and next point (alt1) in meters
+        Works on arrays of alt0 and alt1
         returns minutes of climb/descent time
         """
-        if alt1>alt0:
-            climb = True
-            if not alt1: climb = False
-        else:
-            climb = False
-        if self.platform=='p3':
-            if climb:
-                if alt1 > 6000:
-                    speed = 4.5-7e-05*(alt1+alt0)/2.0
-                else:
-                    speed = 5.0
-            else:
-                speed = -5.0
-        elif self.platform=='er2':
-            if climb:
-                speed = 24.0-0.0011*(alt1+alt0)/2.0
+        alt0,alt1 = np.asarray(alt0,dtype=float),np.asarray(alt1,dtype=float)
+        with np.errstate(invalid='ignore'):
+            climb = (alt1>alt0) & (alt1!=0)
+            if self.platform=='p3':
+                speed = np.where(climb,np.where(alt1>6000,4.5-7e-05*(alt1+alt0)/2.0,5.0),-5.0)
+            elif self.platform=='er2':
+                speed = np.where(climb,24.0-0.0011*(alt1+alt0)/2.0,-10.0)
+            elif self.platform=='dc8':
+                speed = np.where(climb,15.0-0.001*(alt1+alt0)/2.0,-10.0)
+            elif self.platform=='c130':
+                speed = np.where(climb,10.0-0.001*(alt1+alt0)/2.0,-10.0)
             else:
-                speed = -10.0
-        elif self.platform=='dc8':
-            if climb:
-                speed = 15.0-0.001*(alt1+alt0)/2.0
-            else:
-                speed = -10.0
-        elif self.platform=='c130':
-            if climb:
-                speed = 10.0-0.001*(alt1+alt0)/2.0
-            else:
-                speed = -10.0
-        else:
-            if climb:
-                speed = 5.0
-            else:
-                speed = -5.0
-        climb_time = (alt1-alt0)/speed/60.0
-        if not np.isfinite(climb_time):
-            climb_time = 5.0
-            print 'climb time not finite for platform: %s, alt0:%f, alt1:%f' % (self.platform,alt0,alt1)
+                speed = np.where(climb,5.0,-5.0)
+        with np.errstate(invalid='ignore',divide='ignore'):
+            climb_time = (alt1-alt0)/speed/60.0
+        for i in np.where(~np.isfinite(climb_time))[0]:
+            print 'climb time not finite for platform: %s, alt0:%f, alt1:%f' % (self.platform,alt0[i],alt1[i])
+        climb_time[~np.isfinite(climb_time)] = 5.0
         return climb_time
 
-    def calcdatetime(self):
+    def calcdatetime(self,i0=0):
         """
-	Program to convert a utc time and datestr to datetime object
-	"""
-	from datetime import datetime
-	dt = []
-	for i,u in enumerate(self.utc):
+        Program to convert a utc time and datestr to datetime object
+        Only converts the utc times from the index i0 (defaults to 0, all points)
+        """
+        from datetime import datetime
+        dt = []
+        for i,u in enumerate(self.utc[i0:],i0):
             Y,M,D = [int(s) for s in self.datestr.split('-')]
             try:
                 hh = int(u)
             except ValueError:
                 print 'Problem on line :%i with value %f'%(i,u)
                 continue
-	    mm = int((u-hh)*60.0)
-	    ss = int(((u-hh)*60.0-mm)*60.0)
-	    ms = int((((u-hh)*60.0-mm)*60.0-ss)*1000.0)
-	    while hh > 23:
-	    	hh = hh-24
-		D = D+1
-	    try:
+            mm = int((u-hh)*60.0)
+            ss = int(((u-hh)*60.0-mm)*60.0)
+            ms = int((((u-hh)*60.0-mm)*60.0-ss)*1000.0)
+            while hh > 23:
+                hh = hh-24
+                D = D+1
+            try:
                 dt.append(datetime(Y,M,D,hh,mm,ss,ms))
             except ValueError:
                 print 'Problem on line: %i with datetime for datestr: %s' %(i,self.datestr)
@@ -338,7 +863,7 @@ class dict_position:
                 except ValueError:
                     print 'Big problem on 2nd try of calcdatetime with datestr, line: %i'%i
                     continue
-	return dt
+        return dt
 
     def time2xl(self):
         """
@@ -352,37 +877,68 @@ class dict_position:
     def write_to_excel(self):
         """
         writes out the dict_position class values to excel spreadsheet
+        Only the cells that changed since the last write (kept in the shadow copy xl_shadow) are sent, 
+        in one bulk transfer of the block of rows and columns enclosing the changes
         """
-        import numpy as np
-        from xlwings import Range
         self.wb.set_current()
-        Range('A2').value = np.array([self.WP,
-                                      self.lat,
-                                      self.lon,
-                                      self.speed,
-                                      self.delayt,
-                                      self.alt,
-                                      self.cumlegt_xl,
-                                      self.utc_xl,
-                                      self.local_xl,
-                                      self.legt_xl,
-                                      self.dist,
-                                      self.cumdist,
-                                      self.dist_nm,
-                                      self.cumdist_nm,
-                                      self.speed_kts,
-                                      self.alt_kft,
-                                      self.sza,
-                                      self.azi,
-                                      self.bearing,
-                                      self.climb_time
-                                      ]).T
+        rows = self.xl_rows()
+        old = self.xl_shadow
+        if old is None:
+            old = []
+        ch_rows,ch_cols = [],[]
+        for i,row in enumerate(rows):
+            if i<len(old) and old[i]==row:
+                continue
+            ch_rows.append(i)
+            if i<len(old):
+                ch_cols.extend([j for j,v in enumerate(row) if v!=old[i][j]])
+            else:
+                ch_cols.extend([0,len(row)-1])
+        if ch_rows:
+            r0,r1 = min(ch_rows),max(ch_rows)
+            c0,c1 = min(ch_cols),max(ch_cols)
+            self.wb.write('%s%i:%s%i'%(self.xl_cols[c0],r0+2,self.xl_cols[c1],r1+2),[r[c0:c1+1] for r in rows[r0:r1+1]])
+        if len(old)>len(rows):
+            self.wb.clear('A%i:U%i'%(len(rows)+2,len(old)+1))
+        if len(old)<len(rows):
+            self.wb.number_format('G%i:J%i'%(len(old)+2,len(rows)+1),'hh:mm')
+            self.wb.number_format('E%i:E%i'%(len(old)+2,len(rows)+1),'0')
+            self.wb.autofit('B:B')
+            self.wb.autofit('C:C')
+        self.xl_shadow = rows
+
+    def xl_rows(self):
+        """
+        Program to build the list of rows (as written in excel, columns A to U) from the dict_position values
+        NaN values are returned as None, as empty cells are read back from excel
+        """
+        import numpy as np
+        vals = np.array([self.WP,
+                         self.lat,
+                         self.lon,
+                         self.speed,
+                         self.delayt,
+                         self.alt,
+                         self.cumlegt_xl,
+                         self.utc_xl,
+                         self.local_xl,
+                         self.legt_xl,
+                         self.dist,
+                         self.cumdist,
+                         self.dist_nm,
+                         self.cumdist_nm,
+                         self.speed_kts,
+                         self.alt_kft,
+                         self.sza,
+                         self.azi,
+                         self.bearing,
+                         self.climb_time
+                         ],dtype=object).T
+        vals[~np.isfinite(vals.astype(float))] = None
+        rows = vals.tolist()
         for i,c in enumerate(self.comments):
-            Range('U%i'%(i+2)).value = c
-        Range('G2:J%i'% (self.n+1)).number_format = 'hh:mm'
-        Range('E2:E%i'% (self.n+1)).number_format = '0'
-        Range('B:B').autofit('c')
-        Range('C:C').autofit('c')
+            rows[i].append(c)
+        return rows
 
     def check_xl(self):
         """
@@ -399,39 +955,27 @@ class dict_position:
         If there is change, empty out the corresponding calculated areas
         Priority is always given to metric
         """
-        from xlwings import Range
-        import numpy as np
         self.wb.set_current()
-        tmp = Range('A2:U%i'%(self.n+1)).value
-        tmp0 = Range('A2:U2').vertical.value
-        tmp2 = Range('B2:U2').vertical.value
-        dim = np.shape(tmp)
-        if len(dim)==1:
-            tmp = [tmp]
-            dim = np.shape(tmp)
-        dim0 = np.shape(tmp0)
-        if len(dim0)==1: dim0 = np.shape([tmp0])
-        n0,_ = dim0
-        n1,_ = dim
-        dim2 = np.shape(tmp2)
-        if len(dim2)==1: dim2 = np.shape([tmp2])
-        n2,_ = dim2
-        if n0>n1:
-            tmp = tmp0
-        if n2>n0:
-            tmp2 = Range('A2:U%i'%(n2+1)).value
-            if len(np.shape(tmp2))==1:
-                tmp = [tmp2]
-            else:
-                tmp = tmp2
-            if self.verbose:
-                print 'updated to the longer points on lines:%i' %n2
+        # read once, with a few extra lines to catch the points added at the bottom (more reads only if they are all filled)
+        nread = self.n+self.xl_extra_rows
+        tmp = self.wb.read('A2:U%i'%(nread+1))
+        while not all([v is None for v in tmp[-1]]):
+            tmp = tmp+self.wb.read('A%i:U%i'%(nread+2,2*nread+1))
+            nread = 2*nread
+        for i,t in enumerate(tmp):
+            if i>=self.n and all([v is None for v in t]):
+                tmp = tmp[:i]
+                break
         if self.verbose:
-            print 'vertical num: %i, range num: %i' %(n0,n1)
+            print 'range num: %i, points: %i' %(len(tmp),self.n)
         num = 0
         num_del = 0
+        shadow = self.xl_shadow or []
         for i,t in enumerate(tmp):
             if len(t)<16: continue
+            row = [None if v=='' else v for v in t]
+            if i<len(shadow) and shadow[i]==row:
+                continue
             wp,lat,lon,sp,dt,alt,clt,utc,loc,lt,d,cd,dnm,cdnm,spkt,altk = t[0:16]
             try:
                 sza,azi,bear,clbt,comm = t[16:21]
@@ -445,6 +989,8 @@ class dict_position:
                     num = num+1
                     self.dels(i)
                     self.move_xl(i)
+                    if self.xl_shadow:
+                        self.xl_shadow = self.xl_shadow[:i]
                     self.n = self.n-1
                     return True
                 else:
@@ -455,8 +1001,11 @@ class dict_position:
                 if i == 0:
                     if self.utc[i] != utc*24.0:
                         self.utc[i] = utc*24.0
+                        self.utc_dirty = True
                         changed = True
                 if changed: num = num+1
+                if i<len(shadow):
+                    shadow[i] = row # read values are taken into account, even if the check is rerun
                 if self.verbose:
                     print 'Modifying line #%i' %i
         if self.n>(i+1):
@@ -466,7 +1015,7 @@ class dict_position:
                 self.dels(j)
                 self.n = self.n-1
                 num = num+1
-        if num>0:
+        if num>0 or self.i_dirty<self.n: # points deleted on a previous check are also recalculated
             if self.verbose:
                 print 'Updated %i lines from Excel, recalculating and printing' % num
             self.calculate()
@@ -478,25 +1027,15 @@ class dict_position:
         """
         Program that moves up all excel rows by one line overriding the ith line
         """
-        from xlwings import Range
-        linesbelow = Range('A%i:U%i'%(i+3,self.n+1)).value
-        n_rm = (self.n+1)-(i+3)
-        linelist = False
-        for j,l in enumerate(linesbelow):
-            if type(l) is list:
+        if i+3<=self.n+1:
+            linesbelow = self.wb.read('A%i:U%i'%(i+3,self.n+1))
+            for l in linesbelow:
                 try:
                     l[0] = l[0]-1
-                except:
-                    yup = True
-                linesbelow[j] = l
-                linelist = True
-        if not linelist:
-            try:
-                linesbelow[0] = linesbelow[0]-1
-            except:
-                yup = True
-        Range('A%i:U%i'%(i+2,i+2)).value = linesbelow
-        Range('A%i:U%i'%(self.n+1,self.n+1)).clear_contents()
+                except TypeError:
+                    pass
+            self.wb.write('A%i'%(i+2),linesbelow)
+        self.wb.clear('A%i:U%i'%(self.n+1,self.n+1))
 
     def dels(self,i):
         """
@@ -506,29 +1045,11 @@ class dict_position:
         if i+1>len(self.lat):
             print '** Problem: index out of range **'
             return
-        self.lat = np.delete(self.lat,i)
-        self.lon = np.delete(self.lon,i)
-        self.speed = np.delete(self.speed,i)
-        self.delayt = np.delete(self.delayt,i)
-        self.alt = np.delete(self.alt,i)
-        self.alt_kft = np.delete(self.alt_kft,i)
-        self.speed_kts = np.delete(self.speed_kts,i)
-        self.cumlegt = np.delete(self.cumlegt,i)
-        self.utc = np.delete(self.utc,i)
-        self.local = np.delete(self.local,i)
-        self.legt = np.delete(self.legt,i)
-        self.dist = np.delete(self.dist,i)
-        self.cumdist = np.delete(self.cumdist,i)
-        self.dist_nm = np.delete(self.dist_nm,i)
-        self.cumdist_nm = np.delete(self.cumdist_nm,i)
-        self.bearing = np.delete(self.bearing,i)
-        self.endbearing = np.delete(self.endbearing,i)
-        self.turn_deg = np.delete(self.turn_deg,i)
-        self.turn_time = np.delete(self.turn_time,i)
-        self.climb_time = np.delete(self.climb_time,i)
-        self.sza = np.delete(self.sza,i)
-        self.azi = np.delete(self.azi,i)
+        self.store.delete(i)
         self.comments.pop(i)
+        if i<len(self.datetime):
+            self.datetime.pop(i)
+        self.i_dirty = min(self.i_dirty,i)
         try:
             self.WP = np.delete(self.WP,i)
         except:
@@ -544,33 +1065,18 @@ class dict_position:
         Program that appends to the current class with values supplied, or with defaults from the command line
         """
         import numpy as np
-        self.lat = np.append(self.lat,lat)
-        self.lon = np.append(self.lon,lon)
-        self.speed = np.append(self.speed,sp)
-        self.delayt = np.append(self.delayt,dt)
-        self.alt = np.append(self.alt,alt)
         if not clt: clt = np.nan
         if not utc: utc = np.nan
         if not loc: loc = np.nan
         if not lt: lt = np.nan
-        self.cumlegt = np.append(self.cumlegt,clt*24.0)
-        self.utc = np.append(self.utc,utc*24.0)
-        self.local = np.append(self.local,loc*24.0)
-        self.legt = np.append(self.legt,lt*24.0)
-        self.dist = np.append(self.dist,d)
-        self.cumdist = np.append(self.cumdist,cd)
-        self.dist_nm = np.append(self.dist_nm,dnm)
-        self.cumdist_nm = np.append(self.cumdist_nm,cdnm)
-        self.speed_kts = np.append(self.speed_kts,spkt)
-        self.alt_kft = np.append(self.alt_kft,altk)
-        self.bearing = np.append(self.bearing,bear)
-        self.endbearing = np.append(self.endbearing,endbear)
-        self.turn_deg = np.append(self.turn_deg,turnd)
-        self.turn_time = np.append(self.turn_time,turnt)
-        self.climb_time = np.append(self.climb_time,climbt)
-        self.sza = np.append(self.sza,sza)
-        self.azi = np.append(self.azi,azi)
+        self.store.append(lat=lat,lon=lon,speed=sp,delayt=dt,alt=alt,
+                          cumlegt=clt*24.0,utc=utc*24.0,local=loc*24.0,legt=lt*24.0,
+                          dist=d,cumdist=cd,dist_nm=dnm,cumdist_nm=cdnm,
+                          speed_kts=spkt,alt_kft=altk,bearing=bear,endbearing=endbear,
+                          turn_deg=turnd,turn_time=turnt,climb_time=climbt,sza=sza,azi=azi)
         self.comments.append(comm)
+        self.datetime.append(None)
+        self.i_dirty = min(self.i_dirty,len(self.lon)-1)
 
     def mods(self,i,lat=None,lon=None,sp=None,spkt=None,
              dt=None,alt=None,altk=None,comm=None):
@@ -632,6 +1138,8 @@ class dict_position:
                 v = getattr(self,s)
                 v[i] = np.nan
                 setattr(self,s,v)
+        if changed:
+            self.i_dirty = min(self.i_dirty,i)
         if not self.comments[i] == comm:
             self.comments[i] = comm
             changed = True
@@ -645,10 +1153,9 @@ class dict_position:
             filename of excel file to open
             sheet_num: what sheet to activate and load
         Outputs:
-            wb: workbook instance
+            wb: workbook instance, from the spreadsheet backend (self.backend)
         Dependencies:
-            xlwings
-            Excel (win or mac)
+            xlwings and Excel (win or mac), or openpyxl, depending on the backend
             re
             tkSimpleDialog (for datestr)
             datetime
@@ -659,29 +1166,35 @@ class dict_position:
             Modified: Samuel LeBlanc, 2016-06-07, NASA Ames, CA
                       - updated to handle the new excel format with climb time and bearing
                       - added datestr checking and dialog interface
+            Modified: opens the file through the spreadsheet backend (xlwings, openpyxl or memory)
         """
-        from xlwings import Workbook, Sheet, Range
-        import numpy as np
         if not filename:
             print 'No filename found'
             return
+        wb = get_backend(self.backend)
         try:
-            wb = Workbook(filename)
+            wb.open(filename)
         except Exception,ie:
             print 'Exception found:',ie
             return
-        self.name = Sheet(sheet_num).name
-        Sheet(sheet_num).activate()
-        print 'Activating sheet:%i, name:%s'%(sheet_num,Sheet(sheet_num).name)
-        self.datestr = str(Range('W1').value).split(' ')[0]
+        self.wb = wb
+        self.name = wb.sheet_name(sheet_num)
+        wb.activate(sheet_num)
+        print 'Activating sheet:%i, name:%s'%(sheet_num,wb.sheet_name(sheet_num))
+        self.datestr = str(wb.read('W1')).split(' ')[0]
         self.verify_datestr()
-        self.campaign = str(Range('X1').value).split(' ')[0]
+        self.campaign = str(wb.read('X1')).split(' ')[0]
         self.verify_campaign()
         return wb
         
     def verify_datestr(self):
         'Verify the input datestr is correct'
         import re
+        if not self.wb.interactive:
+            if not re.match('[0-9]{4}-[0-9]{2}-[0-9]{2}',self.datestr):
+                print 'No datestring found! Using todays date'
+                self.datestr = datetime.utcnow().strftime('%Y-%m-%d')
+            return
         import tkSimpleDialog
         if not self.datestr:
             self.datestr = tkSimpleDialog.askstring('Flight Date','No datestring found!\nPlease input Flight Date (yyyy-mm-dd):')
@@ -694,6 +1207,8 @@ class dict_position:
             
     def verify_campaign(self):
         'verify the input campaign value'
+        if not self.wb.interactive:
+            return
         import tkSimpleDialog
         self.campaign = tkSimpleDialog.askstring('Campaign name','Please verify campaign name:',initialvalue=self.campaign)
 
@@ -705,10 +1220,9 @@ class dict_position:
         Inputs:
             none
         Outputs:
-            wb: workbook instance 
+            wb: workbook instance, from the spreadsheet backend (self.backend)
         Dependencies:
-            xlwings
-            Excel (win or mac)
+            xlwings and Excel (win or mac), or openpyxl, depending on the backend
         Required files:
             none
         Example:
@@ -719,51 +1233,39 @@ class dict_position:
                     - put into the dic_position class, modified slightly
             Modified: Samuel LeBlanc, 2015-08-25, NASA Ames, CA
                     - modify to permit creation of a new sheet within the current workbook
+            Modified: creates the sheet through the spreadsheet backend (xlwings, openpyxl or memory)
             
         """
-        from xlwings import Workbook, Sheet, Range, Chart
-        import numpy as np
+        wb = get_backend(self.backend)
+        self.wb = wb
         if newsheetonly:
-            Sheet(1).add(name=name)
+            wb.add_sheet(name)
             self.sheet_num = self.sheet_num+1
-            wb = Workbook.current()
         else:
-            wb = Workbook()
             self.name = name
-            Sheet(1).name = self.name
-        Range('A1').value = ['WP','Lat\n[+-90]','Lon\n[+-180]',
+            wb.create(self.name)
+        wb.write('A1',['WP','Lat\n[+-90]','Lon\n[+-180]',
                              'Speed\n[m/s]','delayT\n[min]','Altitude\n[m]',
                              'CumLegT\n[hh:mm]','UTC\n[hh:mm]','LocalT\n[hh:mm]',
                              'LegT\n[hh:mm]','Dist\n[km]','CumDist\n[km]',
                              'Dist\n[nm]','CumDist\n[nm]','Speed\n[kt]',
                              'Altitude\n[kft]','SZA\n[deg]','AZI\n[deg]',
-                             'Bearing\n[deg]','ClimbT\n[min]','Comments']
-        top_line = Range('A1').horizontal
-        address = top_line.get_address(False,False)
-        from sys import platform
-        if platform.startswith('win'):
-            from win32com.client import Dispatch
-            xl = Dispatch("Excel.Application")
-         #   xl.ActiveWorkbook.Windows(1).SplitColumn = 0.4
-            xl.ActiveWorkbook.Windows(1).SplitRow = 1.0
-            xl.Range(address).Font.Bold = True
-        top_line.autofit()
-        Range('G2:J2').number_format = 'hh:mm'
-        Range('W1').value = self.datestr
-        Range('X1').value = self.campaign
-        Range('Z1').value = 'Created with'
-        Range('Z2').value = 'moving_lines'
-        Range('Z3').value = self.__version__
-        Range('W:W').autofit('c')
-        Range('X:X').autofit('c')
-        Range('Z:Z').autofit('c')
-        #Range('A2').value = np.arange(50).reshape((50,1))+1
+                       'Bearing\n[deg]','ClimbT\n[min]','Comments'])
+        wb.format_header('A1:U1')
+        wb.number_format('G2:J2','hh:mm')
+        wb.write('W1',self.datestr)
+        wb.write('X1',self.campaign)
+        wb.write('Z1','Created with')
+        wb.write('Z2','moving_lines')
+        wb.write('Z3',self.__version__)
+        wb.autofit('W:W')
+        wb.autofit('X:X')
+        wb.autofit('Z:Z')
         return wb
 
     def switchsheet(self,i):
         'Switch the active sheet with name supplied'
-        from xlwings import Sheet
-        Sheet(i+1).activate()
+        self.wb.activate(i+1)
 
     def save2xl(self,filename=None):
         """
@@ -774,7 +1276,7 @@ class dict_position:
 
     def get_datestr_from_xl(self):
         'Simple program to get the datestr from the excel spreadsheet'
-        self.datestr = str(Range('W1').value).split(' ')[0]
+        self.datestr = str(self.wb.read('W1')).split(' ')[0]
         
     def save2txt(self,filename=None):
         """ 
@@ -801,7 +1303,6 @@ class dict_position:
         Program to save the points contained in the spreadsheet to a kml file
         """
         import simplekml
-        from xlwings import Sheet
         if not filename:
             raise NameError('filename not defined')
             return
@@ -814,9 +1315,9 @@ class dict_position:
             filenamenet = filename+'_net.kml'
             self.netkml.save(filenamenet)
             self.kml = simplekml.Kml(open=1)
-        for j in xrange(Sheet.count()):
+        for j in xrange(self.wb.count()):
             self.switchsheet(j)
-            self.name = Sheet(j+1).name
+            self.name = self.wb.sheet_name(j+1)
             self.check_xl()
             self.calculate()
             self.kmlfolder = self.kml.newfolder(name=self.name)
@@ -853,7 +1354,8 @@ class dict_position:
         import numpy as np
         cls = [simplekml.Color.red,simplekml.Color.blue,simplekml.Color.green,simplekml.Color.cyan,simplekml.Color.magenta]
         path = folder.newlinestring(name=self.name)
-        coords = [(lon,lat,alt) for (lon,lat,alt) in np.array((self.lon,self.lat,self.alt)).T]
+        track = self.dense_track(dd=10.0)
+        coords = [(lon,lat,alt) for (lon,lat,alt) in np.array((track['lon'],track['lat'],track['alt'])).T]
         path.coords = coords
         path.altitudemode = simplekml.AltitudeMode.clamptoground
         path.extrude = 1
@@ -898,6 +1400,14 @@ class dict_position:
                                   )
             route.points.append(rp)
         f.routes.append(route)
+        track = self.dense_track(dt=60.0)
+        trk = gg.GPXTrack(name=self.datestr)
+        seg = gg.GPXTrackSegment()
+        for i in xrange(len(track['utc'])):
+            seg.points.append(gg.GPXTrackPoint(latitude=track['lat'][i],longitude=track['lon'][i],
+                                               elevation=track['alt'][i],time=self.utc2datetime(track['utc'][i])))
+        trk.segments.append(seg)
+        f.tracks.append(trk)
         fp = open(filename,'w')
         fp.write(f.to_xml())
         fp.close()
@@ -927,7 +1437,7 @@ class dict_position:
                  'campaign':self.campaign,
                  'time_interval':dt,
                  'now':datetime.strptime(self.datestr,'%Y-%m-%d'),
-                 'special_comments':'Simulated aircraft data interpolated from flight plan waypoints',
+                 'special_comments':'Simulated aircraft data interpolated along great circles from flight plan waypoints',
                  'PI_contact':'Samuel LeBlanc, samuel.leblanc@nasa.gov',
                  'platform':self.platform,
                  'location':'N/A',
@@ -944,17 +1454,72 @@ class dict_position:
         
     def interp_points_for_ict(self,dict_in,dt=60.0):
         'Program to interpolate between the waypoints to have a consistent time, defined by dt (defaults to 60 seconds), the variables to be interpolated is defined by dict_in'
-        utcs = np.arange(self.utc[0]*3600,self.utc[-1]*3600,dt)
         # create a dict of points using the input dict as a basis, requires it to have the original_data key for each dict entry
-        # should be replaced by a interpolator that uses great circles
+        # the positions, bearing and solar angles come from the great circle track of dense_track, other variables are linearly interpolated
+        track = self.dense_track(dt=dt)
+        names = {'Latitude':'lat','Longitude':'lon','Altitude':'alt','speed':'speed','Bearing':'bearing','SZA':'sza','AZI':'azi'}
         for k in dict_in.keys():
             if k=='Start_UTC': 
-                dict_in[k]['data'] = utcs
+                dict_in[k]['data'] = track['utc']*3600.0
+            elif k in names:
+                dict_in[k]['data'] = track[names[k]]
             else:
-                fx = interpolate.interp1d(self.utc*3600,dict_in[k]['original_data'],bounds_error=False)
-                dict_in[k]['data'] = fx(utcs)
+                dict_in[k]['data'] = np.interp(track['utc'],self.utc,dict_in[k]['original_data'])
         return dict_in      
 
+    def dense_track(self,dt=None,dd=None):
+        """
+        Program to calculate the flight track at uniform time steps dt (seconds, defaults to 60) or at uniform distance steps dd (km)
+        The positions follow the great circle between the waypoints, reaching the next waypoint at its utc minus its delay time
+        Altitude is linearly interpolated in time between the waypoints, and the speed is the speed of the leg
+        Returns a dict of arrays with the utc (hours), lat, lon, alt (m), speed (m/s), bearing, cumdist (km), 
+        sza, azi (degrees from north) and leg (index of the starting waypoint) of each point, the last waypoint is always included
+        The track is calculated once for each dt or dd and kept until the next calculate, to be shared by the outputs and plots
+        """
+        if not dd and not dt:
+            dt = 60.0
+        key = ('dd',dd) if dd else ('dt',dt)
+        if key in self.track_cache:
+            return self.track_cache[key]
+        i = np.arange(self.n) if self.n>1 else np.array([0,0]) # a single waypoint is a leg of zero length
+        utc,lat,lon,alt,speed,dist,delayt,bearing,endbearing = [np.asarray(x,dtype=float)[i] for x in 
+            (self.utc,self.lat,self.lon,self.alt,self.speed,self.dist,self.delayt,self.bearing,self.endbearing)]
+        dist[0] = 0.0
+        dist = np.nan_to_num(dist)
+        cumdist = np.cumsum(dist)
+        tend = np.maximum(utc[1:]-np.nan_to_num(delayt[1:])/60.0,utc[:-1]) # arrival at the end of each leg
+        with np.errstate(invalid='ignore',divide='ignore'):
+            if dd:
+                d = np.append(np.arange(0.0,cumdist[-1],dd),cumdist[-1])
+                leg = np.clip(np.searchsorted(cumdist,d,side='right')-1,0,len(i)-2)
+                f = np.nan_to_num(np.clip((d-cumdist[leg])/dist[leg+1],0.0,1.0))
+                t = utc[leg]+f*(tend[leg]-utc[leg])
+                t[-1] = utc[-1]
+            else:
+                t = np.append(np.arange(utc[0]*3600.0,utc[-1]*3600.0,dt),utc[-1]*3600.0)/3600.0
+                leg = np.clip(np.searchsorted(utc,t,side='right')-1,0,len(i)-2)
+                f = np.clip((t-utc[leg])/(tend[leg]-utc[leg]),0.0,1.0)
+                f[~np.isfinite(f)] = 1.0
+            fa = np.nan_to_num(np.clip((t-utc[leg])/(utc[leg+1]-utc[leg]),0.0,1.0))
+        # spherical linear interpolation of the unit vectors of the leg ends
+        a,b = mu.lonlat2xyz(lon[leg],lat[leg]),mu.lonlat2xyz(lon[leg+1],lat[leg+1])
+        w = np.arccos(np.clip((a*b).sum(axis=-1),-1.0,1.0))
+        sw = np.sin(w)
+        big = sw>1.0E-12
+        with np.errstate(invalid='ignore',divide='ignore'):
+            ca = np.where(big,np.sin((1.0-f)*w)/sw,1.0-f)
+            cb = np.where(big,np.sin(f*w)/sw,f)
+        p = ca[:,np.newaxis]*a+cb[:,np.newaxis]*b
+        plat = np.degrees(np.arctan2(p[:,2],np.sqrt(p[:,0]**2+p[:,1]**2)))
+        plon = np.degrees(np.arctan2(p[:,1],p[:,0]))
+        brg = mu.bearing(np.column_stack((plat,plon)),np.column_stack((lat[leg+1],lon[leg+1])))
+        brg = np.where(big&(f<1.0),brg,np.where(f<1.0,bearing[leg],endbearing[leg]))
+        sza,azi = mu.get_sza_azi(plat,plon,self.utc2datetime64(t))
+        track = {'utc':t,'lat':plat,'lon':plon,'alt':alt[leg]+fa*(alt[leg+1]-alt[leg]),'speed':speed[leg+1],
+                 'bearing':brg,'cumdist':cumdist[leg]+f*dist[leg+1],'sza':sza,'azi':azi+360.0,'leg':leg}
+        self.track_cache[key] = track
+        return track
+
     def utc2datetime(self,utc):
         'Program to convert the datestr and utc to valid datetime class'
         from datetime import datetime
@@ -970,13 +1535,29 @@ class dict_position:
         microsec = int((secon-seconds)*100)
         return datetime(year,month,day,hour,minutes,seconds,microsec)
 
+    def utc2datetime64(self,utc):
+        'Program to convert the datestr and utc (hours, can be an array) to numpy datetime64, non valid utc returns NaT'
+        us = np.round(np.asarray(utc,dtype=float)*3600.0E6)
+        good = np.isfinite(us)
+        t = np.datetime64(self.datestr,'us')+np.where(good,us,0).astype('int64').astype('timedelta64[us]')
+        return np.where(good,t,np.datetime64('NaT'))
+
+    def sun_along_track(self,dt=1.0):
+        """
+        Program to calculate the solar position along the flight track at a consistent time step defined by dt (defaults to 1 second)
+        The positions are from the great circle track of dense_track, the same as for the ict file
+        Returns the flight duration (hours), the sza and azimuth (degrees from north) at each time step
+        """
+        track = self.dense_track(dt=dt)
+        return track['utc']-track['utc'][0],track['sza'],track['azi']
+
     def exremove(self):
         'Program to remove the current Sheet'
         print 'Not yet'
         pass
         
 
-def populate_ex_arr(filename=None,colorcycle=['red','blue','green']):
+def populate_ex_arr(filename=None,colorcycle=['red','blue','green'],backend='xlwings'):
     """
     Purpose:
         Program that opens an excel file, and runs through the sheets 
@@ -984,20 +1565,21 @@ def populate_ex_arr(filename=None,colorcycle=['red','blue','green']):
     Input:
         filename of excel file
 	colorcycle
+        backend: (optional) spreadsheet backend name or instance, defaults to 'xlwings'
     Output:
         excel_interface dict_position array
     Dependeices:
-        xlwings
+        xlwings, or openpyxl
     History:
         written: Samuel LeBlanc, NASA Ames, Santa Cruz, CA 2015-09-10
     """
-    from xlwings import Workbook,Sheet
     import excel_interface as ex
     arr = []
-    wb = Workbook(filename)
-    num = Sheet.count()
+    wb = ex.get_backend(backend)
+    wb.open(filename)
+    num = wb.count()
     for i in range(num):
-        arr.append(ex.dict_position(filename=filename,sheet_num=i+1,color=colorcycle[i]))
+        arr.append(ex.dict_position(filename=filename,sheet_num=i+1,color=colorcycle[i],backend=wb))
     return arr
 
 def get_curdir():
@@ -167,7 +167,7 @@ class gui:
         import excel_interface as ex
         self.flight_num = 0
         self.iactive.set(0)
-        self.line.ex_arr = ex.populate_ex_arr(filename=filename,colorcycle=self.colorcycle)
+        self.line.ex_arr = ex.populate_ex_arr(filename=filename,colorcycle=self.colorcycle,backend=self.line.ex.backend)
         self.line.m.ax.set_title(self.line.ex_arr[0].datestr)
         for b in self.flightselect_arr:
             b.destroy()
@@ -176,11 +176,13 @@ class gui:
             self.line.m.figure_under.remove()
         except:
             pass
-        try:
-            for s in self.sat_obj:
+        for s in getattr(self,'sat_obj',[]):
+            try:
                 s.remove()
-        except:
-            pass
+            except:
+                pass
+        from map_interactive import remove_sat_tracks
+        remove_sat_tracks(self.line.m)
         self.colors = []
         for i in range(len(self.line.ex_arr)):
 	    self.line.ex = self.line.ex_arr[i]
@@ -282,7 +284,9 @@ class gui:
         tb.update()
         canvas._tkcanvas.pack(side=tk.TOP,fill=tk.BOTH,expand=1)
         ax1 = fig.add_subplot(2,1,1)
-        ax1.plot(self.line.ex.cumlegt,self.line.ex.sza,'x-')
+        cumt,sza,azi = self.line.ex.sun_along_track(dt=1.0)
+        ax1.plot(cumt,sza,'b-')
+        ax1.plot(self.line.ex.cumlegt,self.line.ex.sza,'bx')
         ax1.set_title('Solar position along flight track for %s on %s' %(self.line.ex.name,self.line.ex.datestr), y=1.18)
         fig.subplots_adjust(top=0.85)
         #ax1.set_xlabel('Flight duration [Hours]')
@@ -298,6 +302,8 @@ class gui:
         ax1_up.set_xticklabels(utc_label)
         ax1_up.set_xlabel('UTC [Hours]')
         ax2 = fig.add_subplot(2,1,2,sharex=ax1)
+        ax2.plot(cumt,azi,'-k',lw=0.5)
+        ax2.plot(cumt,azi-180,'-',color='lightgrey',lw=0.5)
         ax2.plot(self.line.ex.cumlegt,self.line.ex.azi,'ok',label='Sun PP')
         ax2.plot(self.line.ex.cumlegt,[a-180 for a in self.line.ex.azi],'o',color='lightgrey',label='Sun anti-PP')
         ax2.set_ylabel('Azimuth angle [degree]')
@@ -365,7 +371,8 @@ class gui:
                                                  lon0=self.line.ex.lon[0],lat0=self.line.ex.lat[0],
                                                  UTC_start=self.line.ex.utc[0],
                                                  UTC_conversion=self.line.ex.UTC_conversion,
-                                                 alt0=self.line.ex.alt[0],version=self.line.ex.__version__,campaign=self.line.ex.campaign))
+                                                 alt0=self.line.ex.alt[0],version=self.line.ex.__version__,campaign=self.line.ex.campaign,
+                                                 backend=self.line.ex.wb))
         self.line.newline()
         self.iactive.set(self.flight_num)
         self.gui_changeflight()
@@ -529,27 +536,24 @@ class gui:
         from tkMessageBox import askquestion
         answer = askquestion('Verify import satellite tracks','Do you want to get the satellite tracks from the internet?')
         if answer == 'yes':
-            from map_interactive import load_sat_from_net, get_sat_tracks, plot_sat_tracks
+            from map_interactive import get_sat_tracks_from_kml, plot_sat_tracks
             self.line.tb.set_message('Loading satellite kml File from internet')
-            kml = load_sat_from_net()
-            if kml:
-                self.line.tb.set_message('parsing file...')
-                sat = get_sat_tracks(self.line.ex.datestr,kml)
+            sat = get_sat_tracks_from_kml(self.line.ex.datestr)
+            if sat:
                 self.line.tb.set_message('Plotting satellite tracks')
                 self.sat_obj = plot_sat_tracks(self.line.m,sat)
         elif answer ==  'no':
-            from map_interactive import load_sat_from_file, get_sat_tracks, plot_sat_tracks
+            from map_interactive import get_sat_tracks_from_kml, plot_sat_tracks
             filename = self.gui_file_select(ext='.kml',ftype=[('All files','*.*'),
                                                          ('Google Earth','*.kml')])
             if not filename:
                 print 'Cancelled, no file selected'
                 return
             self.line.tb.set_message('Opening kml File:'+filename)
-            kml = load_sat_from_file(filename)
-            self.line.tb.set_message('parsing file...')
-            sat = get_sat_tracks(self.line.ex.datestr,kml)
-            self.line.tb.set_message('Plotting satellite tracks') 
-            self.sat_obj = plot_sat_tracks(self.line.m,sat)
+            sat = get_sat_tracks_from_kml(self.line.ex.datestr,filename=filename)
+            if sat:
+                self.line.tb.set_message('Plotting satellite tracks') 
+                self.sat_obj = plot_sat_tracks(self.line.m,sat)
         self.line.get_bg()
 
     def gui_addsat_tle(self):
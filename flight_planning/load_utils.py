@@ -12,6 +12,7 @@ def __init__():
            - cpl_layers text file
            - apr2 files
            - hdf files
+           - ict files, at once or in chunks
            
         details are in the info of each module
     """
@@ -132,7 +133,7 @@ def load_modis(geofile,datfile):
 
 # <codecell>
 
-def load_ict(fname,return_header=False,make_nan=True):
+def load_ict(fname,return_header=False,make_nan=True,chunk_size=100000):
     """
     Simple ict file loader
     created specifically to load the files from the iwg1 on board the G1 during TCAP, may work with others...
@@ -140,34 +141,14 @@ def load_ict(fname,return_header=False,make_nan=True):
        fname: filename with full path
        return_header: (default set to False) if True, returns data, header in that form
        make_nan: (default set to True) if True, the values defined in the header to be missing data, usually -999, is changed to NaNs
+       chunk_size: (default 100000) number of data lines parsed at once, see iter_ict
+    The missing values are matched on the values as written in the file, before applying the scale factors
     """
-    from datetime import datetime
     import numpy as np
-    f = open(fname,'r')
-    lines = f.readlines()
-    first = lines[0]
-    num2skip = int(first.strip().split(',')[0])
-    header = lines[0:num2skip]
-    factor = map(float,header[10].strip().split(','))
-    missing = map(float,header[11].strip().split(','))
-    f.close()
-    if any([i!=1 for i in factor]):
-        print('Some Scaling factors are not equal to one, Please check the factors:')
-        print factor
-    def mktime(txt):
-        return datetime.strptime(txt,'%Y-%m-%d %H:%M:%S')
-    def utctime(seconds_utc):
-        return float(seconds_utc)/3600.
-    conv = {"Date_Time":mktime, "UTC":utctime, "Start_UTC":utctime, "TIME_UTC":utctime, "UTC_mid":utctime}
-    data = np.genfromtxt(fname,names=True,delimiter=',',skip_header=num2skip-1,converters=conv)
+    header = []
+    chunks = [c for c in iter_ict(fname,make_nan=make_nan,chunk_size=chunk_size,header=header)]
+    data = np.concatenate(chunks) if len(chunks)>1 else chunks[0]
     print data.dtype.names
-    #scale the values by using the scale factors
-    for i,name in enumerate(data.dtype.names):
-        if i>0:
-            if factor[i-1]!=float(1):
-                data[name] = data[name]*factor[i-1]
-            if make_nan:
-                data[name][data[name]==missing[i-1]]=np.NaN
     if return_header:
         return data, header
     else:
@@ -175,6 +156,89 @@ def load_ict(fname,return_header=False,make_nan=True):
 
 # <codecell>
 
+def load_ict_header(f):
+    """
+    Reads the header of an ict file, from an open file object which is left at the start of the data lines
+    returns a dict with:
+       lines: list of the header lines
+       names: the variable names, as used for the fields of the loaded data
+       factor: the scale factors of each variable, other than the independent variable
+       missing: the missing data values of each variable, other than the independent variable
+    """
+    import numpy as np
+    first = f.readline()
+    num2skip = int(first.strip().split(',')[0])
+    lines = [first]+[f.readline() for i in xrange(num2skip-1)]
+    factor = map(float,lines[10].strip().split(','))
+    missing = map(float,lines[11].strip().split(','))
+    names = np.lib._iotools.NameValidator()([str(n.strip()) for n in lines[-1].split(',')])
+    return {'lines':lines,'names':names,'factor':factor,'missing':missing}
+
+# <codecell>
+
+def iter_ict(fname,chunk_size=100000,make_nan=True,header=None):
+    """
+    Generator that reads an ict file in chunks of data lines, for files too large to load at once
+    Yields structured arrays of at most chunk_size lines, with the same fields as load_ict
+    inputs:
+       fname: filename with full path
+       chunk_size: (default 100000) number of data lines in each chunk
+       make_nan: (default set to True) if True, the values defined in the header to be missing data are changed to NaNs
+       header: (optional) list that is filled with the header lines
+    """
+    from datetime import datetime
+    from itertools import islice
+    import numpy as np
+    import warnings
+    with open(fname,'r') as f:
+        head = load_ict_header(f)
+        if header is not None:
+            header.extend(head['lines'])
+        names = head['names']
+        factor,missing = head['factor'],head['missing']
+        if any([i!=1 for i in factor]):
+            print('Some Scaling factors are not equal to one, Please check the factors:')
+            print factor
+        def mktime(txt):
+            return datetime.strptime(txt,'%Y-%m-%d %H:%M:%S')
+        utc_names = ["UTC", "Start_UTC", "TIME_UTC", "UTC_mid"]
+        conv = {}
+        if "Date_Time" in names:
+            conv[names.index("Date_Time")] = mktime
+        dtype = np.dtype([(n,object if i in conv else float) for i,n in enumerate(names)])
+        nc = len(names)
+        empty = True
+        while True:
+            lines = list(islice(f,chunk_size))
+            if not lines:
+                break
+            # all numeric lines are read in C by numpy, anything else goes through genfromtxt
+            data = None
+            if not conv:
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore',DeprecationWarning)
+                    v = np.fromstring(','.join(lines),sep=',')
+                if v.size==len(lines)*nc:
+                    data = v.reshape(-1,nc).view(dtype).ravel()
+            if data is None:
+                data = np.atleast_1d(np.genfromtxt(lines,delimiter=',',dtype=dtype,converters=conv,autostrip=True))
+            for i,name in enumerate(names):
+                if i in conv:
+                    continue
+                if i>0:
+                    if make_nan:
+                        data[name][data[name]==missing[i-1]] = np.NaN
+                    if factor[i-1]!=float(1):
+                        data[name] = data[name]*factor[i-1]
+                if name in utc_names:
+                    data[name] = data[name]/3600.
+            empty = False
+            yield data
+        if empty:
+            yield np.zeros(0,dtype=dtype)
+
+# <codecell>
+
 def modis_qa(qa_array):
     """
     modis qa data parser.
@@ -6,9 +6,10 @@ import numpy as np
 import sys
 import re
 import copy
+import time
 
 import map_interactive as mi
-from map_utils import spherical_dist,equi,shoot,bearing
+from map_utils import spherical_dist,equi,shoot,bearing,lonlat2xyz,rotate_unit_vectors
 
 class LineBuilder:
     """
@@ -72,6 +73,16 @@ class LineBuilder:
         self.circlesoff = False
         self.moving = False
         self.lbl = None
+        self.bg_labels = None
+        self.bg_labels_line = None
+        self.bg_labels_size = None
+        self.circle_artists = None
+        self.circle_templates = {}
+        self.circle_band = 1.0
+        self.frame_interval = 16 # ms, minimum time between redraws while dragging a point
+        self.drag_timer = None
+        self.drag_line = None
+        self.drag_xy = None
         self.verbose = verbose
         self.blit = blit
         self.get_bg()
@@ -98,6 +109,9 @@ class LineBuilder:
             'figure_enter_event',self.onfigureenter)
         self.cid_onaxesenter = self.line.figure.canvas.mpl_connect(
             'axes_enter_event',self.onfigureenter)
+        if not hasattr(self,'cid_ondraw'):
+            self.cid_ondraw = self.line.figure.canvas.mpl_connect(
+                'draw_event',self.ondraw)
 
     def disconnect(self):
         'Function to disconnect all events (except keypress)'
@@ -118,9 +132,7 @@ class LineBuilder:
         if self.contains:
             if self.verbose:
                 print 'click is near point:',self.contains,attrd
-            self.contains_index = attrd['ind']
-            if len(self.contains_index)>1:
-                self.contains_index = self.contains_index[-1]
+            self.contains_index = int(attrd['ind'][-1])
             if self.verbose:
                 print 'index:%i'%self.contains_index
             if self.contains_index != 0:
@@ -160,7 +172,7 @@ class LineBuilder:
         else:
             self.azi = None
         self.line.range_circles,self.line.range_cir_anno = self.plt_range_circles(self.lons[ilola],self.lats[ilola],azi=self.azi)
-        self.draw_canvas(extra_points=[self.line.range_circles,self.line.range_cir_anno])
+        self.start_drag(self.contains_index if self.contains else len(self.xs)-1)
         self.press = event.xdata,event.ydata
         if self.verbose:
             sys.stdout.write('moving:')
@@ -191,6 +203,9 @@ class LineBuilder:
             else:
                 par = np.arange(round_to_5(ylim[0]),round_to_5(ylim[1])+5,5)
             mi.update_pars_mers(self.m,mer,par)
+            mi.update_map_resolution(self.m)
+            mi.update_sat_tracks(self.m)
+            mi.update_map_labels(self.m)
             self.line.figure.canvas.draw()
             self.get_bg()
             return
@@ -199,6 +214,7 @@ class LineBuilder:
         
         if event.inaxes!=self.line.axes: return
         self.press = None
+        self.end_drag()
         self.line.axes.format_coord = self.format_position_simple
         
         if self.contains:
@@ -217,19 +233,16 @@ class LineBuilder:
                 self.ex.appends(self.lats[-1],self.lons[-1])
                 self.ex.calculate()
                 self.ex.write_to_excel()
-        for lrc in self.line.range_circles:
-            self.m.ax.lines.remove(lrc)
-        for arc in self.line.range_cir_anno:
-            try:
-                arc.remove()
-            except:
-                continue
-        self.update_labels()
-        self.line.figure.canvas.draw()
+        self.hide_range_circles()
+        self.update_labels(redraw=False)
+        self.get_bg(redraw=True)
             
 
     def onmotion(self,event):
-        'Function that moves the points to desired location'
+        """
+        Function that moves the points to desired location
+        Only keeps the latest position, the redraw is done by drag_frame at most once every frame_interval
+        """
         if event.inaxes!=self.line.axes: return
         if self.press is None: return
         if self.tb.mode!='': return
@@ -237,20 +250,92 @@ class LineBuilder:
         if self.verbose:
             sys.stdout.write("\r"+" moving: x=%2.5f, y=%2.5f" %(event.xdata,event.ydata))
             sys.stdout.flush()
-        if self.contains:
-            i = self.contains_index
-            self.highlight_linepoint.set_data(event.xdata,event.ydata)
+        self.drag_events = self.drag_events+1
+        pending = self.drag_xy is not None
+        self.drag_xy = event.xdata,event.ydata
+        if pending:
+            return
+        if self.drag_timer:
+            self.drag_timer.start()
         else:
-            i = -1
-        self.xs[i] = event.xdata
-        self.ys[i] = event.ydata
+            self.drag_frame()
+
+    def start_drag(self,i):
+        """
+        Program to prepare the dragging of the point i
+        When using blit, the point and its two adjacent segments are moved to a separate animated line (drag_line),
+        and the background is saved without them, so that each frame only redraws those
+        """
+        self.drag_i = i
+        self.drag_xy = None
+        self.drag_events = 0
+        self.drag_frames = 0
+        if self.drag_timer is None:
+            try:
+                self.drag_timer = self.line.figure.canvas.new_timer(interval=self.frame_interval)
+                self.drag_timer.single_shot = True
+                self.drag_timer.add_callback(self.drag_frame)
+            except Exception:
+                self.drag_timer = False
+        if not self.blit:
+            self.draw_canvas()
+            return
+        if self.drag_line:
+            self.drag_line.remove()
+        j0,j1 = max(i-1,0),min(i+1,len(self.xs)-1)
+        self.drag_line, = self.line.axes.plot(self.xs[j0:j1+1],self.ys[j0:j1+1])
+        self.drag_line.update_from(self.line)
+        self.drag_line.set_animated(True)
+        xs,ys = list(self.xs),list(self.ys)
+        xs[i],ys[i] = np.nan,np.nan
+        self.line.set_data(xs,ys)
+        if self.contains:
+            self.highlight_linepoint.set_animated(True)
+        self.get_bg(redraw=True)
+        self.draw_drag()
+
+    def drag_frame(self):
+        'Program to move the dragged point to the latest position, and redraw only the dragged part'
+        if self.drag_xy is None: return
+        t0 = time.time()
+        x,y = self.drag_xy
+        self.drag_xy = None
+        i = self.drag_i
+        self.xs[i] = x
+        self.ys[i] = y
         if self.m:
-            self.lons[i],self.lats[i] = self.m(event.xdata,event.ydata,inverse=True)
-        self.line.set_data(list(self.xs),list(self.ys))
+            self.lons[i],self.lats[i] = self.m(x,y,inverse=True)
         if self.contains:
-            self.draw_canvas(extra_points=[self.highlight_linepoint,self.line.range_circles,self.line.range_cir_anno])
+            self.highlight_linepoint.set_data(x,y)
+        if self.drag_line:
+            j0,j1 = max(i-1,0),min(i+1,len(self.xs)-1)
+            self.drag_line.set_data(self.xs[j0:j1+1],self.ys[j0:j1+1])
+            self.draw_drag()
         else:
-            self.draw_canvas(extra_points=[self.line.range_circles,self.line.range_cir_anno])       
+            self.line.set_data(list(self.xs),list(self.ys))
+            self.draw_canvas()
+        self.drag_frames = self.drag_frames+1
+        self.tb.set_message('Moving point #%i: frame time %.1f ms, dropped events: %i' %(i+1,(time.time()-t0)*1000.0,
+                                                                                   self.drag_events-self.drag_frames))
+
+    def draw_drag(self):
+        'Program to blit the dragged point and segments over the saved background'
+        canvas = self.line.figure.canvas
+        canvas.restore_region(self.bg)
+        self.line.axes.draw_artist(self.drag_line)
+        if self.contains:
+            self.line.axes.draw_artist(self.highlight_linepoint)
+        canvas.blit(self.line.axes.bbox)
+
+    def end_drag(self):
+        'Program to apply the last dragged position and put back the full line'
+        if self.drag_timer:
+            self.drag_timer.stop()
+        self.drag_frame()
+        if self.drag_line:
+            self.drag_line.remove()
+            self.drag_line = None
+        self.line.set_data(self.xs,self.ys)
 
     def onkeypress(self,event):
         'function to handle keyboard events'
@@ -313,8 +398,13 @@ class LineBuilder:
             self.r = sqrt((x-x0)**2+(y-y0)**2)
             return 'x=%2.5f, y=%2.5f, d=%2.5f' % (x,y,self.r)
         
-    def update_labels(self):
-        'method to update the waypoints labels after each recalculations'
+    def update_labels(self,redraw=True):
+        """
+        method to update the waypoints labels after each recalculations
+        The label artists are kept from one call to the next (in self.lbl), only the labels that moved are updated,
+        and labels are only created or removed when the number of waypoints changes.
+        The labels are animated, drawn over the background by ondraw, and updated on the canvas with blit
+        """
         #import matplotlib as mpl
         #if mpl.rcParams['text.usetex']:
         #    s = '\#'
@@ -326,59 +416,160 @@ class LineBuilder:
         else:
             self.n = len(self.xs)
             self.wp = range(1,self.n+1)
-        if self.lbl:
-           for ll in self.lbl:
-                try:
-                    ll.remove()
-                except:
-                    continue
-        if self.labelsoff:
-            return
-        for i in self.wp:    
-            if not self.lbl:
-                self.lbl = [self.line.axes.annotate(s+'%i'%i,
-                                                    (self.xs[i-1],self.ys[i-1]))]
+        if not self.lbl:
+            self.lbl = []
+        n = 0 if self.labelsoff else len(self.wp)
+        changed = len(self.lbl)>n
+        for ll in self.lbl[n:]:
+            try:
+                ll.remove()
+            except:
+                continue
+        del self.lbl[n:]
+        for k in xrange(n):
+            i = self.wp[k]
+            xy = (self.xs[i-1],self.ys[i-1])
+            if k<len(self.lbl):
+                ll = self.lbl[k]
+                if ll.get_text()!=s+'%i'%i:
+                    ll.set_text(s+'%i'%i)
+                    changed = True
+                if ll.xy!=xy:
+                    ll.xy = xy
+                    ll.set_position(xy)
+                    changed = True
             else:
-                if not self.xs[i-1]:
-                    continue
-                self.lbl.append(self.line.axes.
-                                annotate(s+'%i'%i,(self.xs[i-1],self.ys[i-1])))
-        self.line.figure.canvas.draw()
+                ll = self.line.axes.annotate(s+'%i'%i,xy,animated=True)
+                self.lbl.append(ll)
+                changed = True
+            if ll.get_visible()!=(k==0 or bool(xy[0])):
+                ll.set_visible(k==0 or bool(xy[0]))
+                changed = True
+        if redraw and (changed or not self.bg_labels_current()):
+            self.draw_labels()
+
+    def ondraw(self,event):
+        'event handler for full canvas draws, saves the background without the labels and draws the labels over it'
+        canvas = self.line.figure.canvas
+        if canvas.is_saving():
+            # savefig draws the animated labels itself, at the print resolution and with its own renderer,
+            # so the next label update needs a full draw of the screen canvas
+            self.bg_labels = None
+            return
+        self.bg_labels = canvas.copy_from_bbox(self.line.axes.bbox)
+        self.bg_labels_line = self.line.get_xydata().copy()
+        self.bg_labels_size = (canvas.get_width_height(),self.line.figure.dpi)
+        for ll in self.lbl or []:
+            self.line.axes.draw_artist(ll)
+
+    def bg_labels_current(self):
+        'check if the background saved at the last full draw can be reused, it includes the flight line so that must not have moved since'
+        if self.bg_labels is None:
+            return False
+        if self.bg_labels_size!=(self.line.figure.canvas.get_width_height(),self.line.figure.dpi):
+            return False
+        return np.array_equal(self.line.get_xydata(),self.bg_labels_line)
+
+    def draw_labels(self):
+        'Program to redraw only the labels over the background saved at the last full draw, and blit them'
+        if not self.blit or not self.bg_labels_current():
+            self.line.figure.canvas.draw()
+            self.get_bg()
+            return
+        canvas = self.line.figure.canvas
+        canvas.restore_region(self.bg_labels)
+        for ll in self.lbl:
+            self.line.axes.draw_artist(ll)
+        self.get_bg()
+        self.line.axes.draw_artist(self.line)
+        canvas.blit(self.line.axes.bbox)
 
     def plt_range_circles(self,lon,lat,azi=None):
-        'program to plot range circles starting from the last point selected on the map, with principal plane identified'        
+        """
+        program to plot range circles starting from the last point selected on the map, with principal plane identified
+        The geometry comes from the cached templates of range_circles_template, rotated to the selected point,
+        and the circles, labels and ticks artists are reused (updated with set_data) from one click to the next
+        """
         if self.circlesoff:
-            return
+            return [],[]
         diam = [50.0,100.0,200.0,500.0,1000.0]
         colors = ['lightgrey','lightgrey','lightgrey','lightsalmon','crimson']
-        line = []
-        an = []
-        for i,d in enumerate(diam):
-            ll, = equi(self.m,lon,lat,d,color=colors[i])
-            line.append(ll)
-            slon,slat,az = shoot(lon,lat,0.0,d)
-            x,y = self.m(slon,slat)
-            ano = self.line.axes.annotate('%i km' %(d),(x,y),color='silver')
-            an.append(ano)
+        t = self.range_circles_template(lat,diam)
+        xyz = [t['circles'].reshape(-1,3),t['labels'],t['ticks'].reshape(-1,3)]
         if azi:
-            slon,slat,az = shoot(lon,lat,azi,diam[-1])
-            mlon,mlat,az = shoot(lon,lat,azi+180.0,diam[-1])
-            lazi1, = self.m.plot([slon],[slat],'--*',color='grey',markeredgecolor='#BBBB00',markerfacecolor='#EEEE00',markersize=20)
-            lazi2, = self.m.plot([mlon,lon,slon],[mlat,lat,slat],'--',color='grey')
-            line.append(lazi1)
-            line.append(lazi2)
-        for deg in [0,90,180,270]:
-            dlo,dla,az = shoot(lon,lat,deg,diam[-1])
-            elo,ela,az = shoot(lon,lat,deg,diam[-1]*0.85)
-            ll, = self.m.plot([elo,dlo],[ela,dla],'-',color='grey')
-            line.append(ll)
-            for dd in [22.5,45.0,67.5]:
-                dlo,dla,az = shoot(lon,lat,deg+dd,diam[-1])
-                elo,ela,az = shoot(lon,lat,deg+dd,diam[-1]*0.93)
-                ll, = self.m.plot([elo,dlo],[ela,dla],'-',color='grey')
+            # principal plane points interpolated along the largest circle (1 degree azimuth steps)
+            a = np.array([azi,azi+180.0])%360.0
+            ia = a.astype(int)
+            fa = (a-ia)[:,np.newaxis]
+            pp = (1.0-fa)*t['circles'][-1,ia,:]+fa*t['circles'][-1,ia+1,:]
+            xyz.append(pp/np.sqrt((pp**2).sum(axis=1))[:,np.newaxis])
+        lons,lats = rotate_unit_vectors(np.vstack(xyz),lat-t['lat'],lon)
+        x,y = self.m(lons,lats)
+        nc = t['circles'].shape[1]
+        n0,n1 = len(diam)*nc,len(diam)*nc+len(diam)
+        cx,cy = x[:n0].reshape(len(diam),nc),y[:n0].reshape(len(diam),nc)
+        lx,ly = x[n0:n1],y[n0:n1]
+        tx,ty = x[n1:n1+t['ticks'].size/3].reshape(2,-1),y[n1:n1+t['ticks'].size/3].reshape(2,-1)
+        x0,y0 = self.m(lon,lat)
+        if not self.circle_artists:
+            # first call, create the artists
+            line,an = [],[]
+            for i,d in enumerate(diam):
+                ll, = self.line.axes.plot(cx[i],cy[i],color=colors[i])
                 line.append(ll)
+                an.append(self.line.axes.annotate('%i km' %(d),(lx[i],ly[i]),color='silver'))
+            lazi1, = self.line.axes.plot([],[],'--*',color='grey',markeredgecolor='#BBBB00',markerfacecolor='#EEEE00',markersize=20)
+            lazi2, = self.line.axes.plot([],[],'--',color='grey')
+            line.extend([lazi1,lazi2])
+            for j in xrange(tx.shape[1]):
+                ll, = self.line.axes.plot([tx[1,j],tx[0,j]],[ty[1,j],ty[0,j]],'-',color='grey')
+                line.append(ll)
+            self.circle_artists = line,an
+        line,an = self.circle_artists
+        for i in xrange(len(diam)):
+            line[i].set_data(cx[i],cy[i])
+            an[i].xy = (lx[i],ly[i])
+            an[i].set_position((lx[i],ly[i]))
+        lazi1,lazi2 = line[len(diam)],line[len(diam)+1]
+        if azi:
+            (sx,mx),(sy,my) = x[-2:],y[-2:]
+            lazi1.set_data([sx],[sy])
+            lazi2.set_data([mx,x0,sx],[my,y0,sy])
+        lazi1.set_visible(bool(azi))
+        lazi2.set_visible(bool(azi))
+        for j in xrange(tx.shape[1]):
+            line[len(diam)+2+j].set_data([tx[1,j],tx[0,j]],[ty[1,j],ty[0,j]])
+        for a in line+an:
+            if a not in (lazi1,lazi2):
+                a.set_visible(True)
         return line,an
 
+    def range_circles_template(self,lat,diam):
+        """
+        Program to return the range circles geometry, as unit vectors centered at longitude 0 and at the latitude band of lat
+        The templates are calculated once per latitude band (of circle_band degrees) and kept in circle_templates
+        Contains the circles (1 degree azimuth steps), the distance labels (north of the center) 
+        and the ticks every 22.5 degrees (outer and inner ends, longer at the cardinal directions)
+        """
+        lat_b = round(lat/self.circle_band)*self.circle_band
+        if lat_b in self.circle_templates:
+            return self.circle_templates[lat_b]
+        d = np.array(diam)[:,np.newaxis]
+        clon,clat,az = shoot(0.0,lat_b,np.arange(0,361),d)
+        degs = np.arange(0.0,360.0,22.5)
+        tlon,tlat,az = shoot(0.0,lat_b,degs,np.vstack([degs*0.0+1.0,np.where(degs%90.0==0,0.85,0.93)])*diam[-1])
+        t = {'lat':lat_b,
+             'circles':lonlat2xyz(clon,clat),
+             'labels':lonlat2xyz(clon[:,0],clat[:,0]),
+             'ticks':lonlat2xyz(tlon,tlat)}
+        self.circle_templates[lat_b] = t
+        return t
+
+    def hide_range_circles(self):
+        'Program to hide the range circles, keeping the artists for the next click'
+        for a in self.line.range_circles+self.line.range_cir_anno:
+            a.set_visible(False)
+
     def makegrey(self):
         'Program to grey out the entire path'
         self.line.set_color('#AAAAAA')
@@ -485,13 +676,18 @@ class LineBuilder:
         else:
             self.line.figure.canvas.draw()
         
-def build_basemap(lower_left=[-20,-30],upper_right=[20,10],ax=None,proj='cyl',profile=None):
+def build_basemap(lower_left=[-20,-30],upper_right=[20,10],ax=None,proj='cyl',profile=None,resolution=None,cache_dir=None):
     """
     First try at a building of the basemap with a 'stere' projection
     Must put in the values of the lower left corner and upper right corner (lon and lat)
     
     Defaults to draw 8 meridians and parallels
 
+    The coastlines, states and countries are drawn from the projected geometries cached on disk by map_boundaries,
+    set cache_dir to False to not use the disk cache
+    If resolution is not set, it is chosen from the extent of the map (see lod_resolution), 
+    and is then changed with the zoom level by update_map_resolution
+
     Modified: Samuel LeBlanc, 2015-09-15, NASA Ames
             - added profile keyword that contains the basemap profile dict for plotting the corners
             - added programatic determination of basemap parallels and meridians
@@ -502,14 +698,20 @@ def build_basemap(lower_left=[-20,-30],upper_right=[20,10],ax=None,proj='cyl',pr
         lower_left = [pll(profile['Lon_range'][0]),pll(profile['Lat_range'][0])]
         
         
-    m = Basemap(projection=proj,lon_0=(upper_right[0]+lower_left[0])/2.0,lat_0=(upper_right[1]+lower_left[1])/2.0,
+    kwargs = dict(projection=proj,lon_0=(upper_right[0]+lower_left[0])/2.0,lat_0=(upper_right[1]+lower_left[1])/2.0,
             llcrnrlon=lower_left[0], llcrnrlat=lower_left[1],
-            urcrnrlon=upper_right[0], urcrnrlat=upper_right[1],resolution='h',ax=ax)
-    m.artists = []
-    m.drawcoastlines()
+            urcrnrlon=upper_right[0], urcrnrlat=upper_right[1])
+    m = Basemap(resolution=None,ax=ax,**kwargs)
+    m.basemap_kwargs = kwargs
+    m.boundary_artists = {}
+    m.boundaries = {}
+    m.boundary_resolution = None
+    m.cache_dir = cache_dir
+    if not resolution:
+        resolution = lod_resolution(m,xlim=(m.llcrnrx,m.urcrnrx),ylim=(m.llcrnry,m.urcrnry))
+    update_map_resolution(m,resolution)
+    m.set_axes_limits(ax=ax)
     #m.fillcontinents(color='#AAAAAA')
-    m.drawstates()
-    m.drawcountries()
     round_to_5 = lambda x:(int(x/5)+1)*5 
     mer = np.arange(round_to_5(lower_left[0]),round_to_5(upper_right[0])+5,5)
     par = np.arange(round_to_5(lower_left[1]),round_to_5(upper_right[1])+5,5)
@@ -517,34 +719,235 @@ def build_basemap(lower_left=[-20,-30],upper_right=[20,10],ax=None,proj='cyl',pr
     #mer = np.linspace(lower_left[0],upper_right[0],8).astype(int)
     #par = np.linspace(-25,5,7).astype(int)
     #par = np.linspace(lower_left[1],upper_right[1],8).astype(int)
-    m.artists.append(m.drawmeridians(mer,labels=[0,0,0,1]))
-    m.artists.append(m.drawparallels(par,labels=[1,0,0,0]))
+    update_pars_mers(m,mer,par)
     return m
 
-def update_pars_mers(m,meridians,parallels):
-    'Simple program to remove old meridians and parallels and plot new ones'
-    r = 0
-    for a in m.artists:
+def map_boundaries(m,resolution='h',cache_dir=None):
+    """
+    Purpose:
+        Get the projected coastlines, countries and states geometries for the basemap m, at resolution
+        Reads the geometries from a disk cache (memory-mapped) keyed by the projection, corners and resolution, 
+        if not in the cache, builds a basemap at that resolution to read the boundaries and saves them to the cache
+    Inputs:
+        m: basemap instance made by build_basemap (uses m.basemap_kwargs)
+        resolution: (default 'h') basemap resolution of the boundaries (c,l,i,h,f)
+        cache_dir: (optional) directory of the cache, defaults to moving_lines_map_cache in the temp directory
+                   if False, does not use the disk cache
+    Outputs:
+        dict of coastlines, countries, and states, each a tuple of (xy,idx), 
+        with xy the projected points of all segments (n by 2 array) and idx the start of each segment, and the end of the last
+    Dependencies:
+        numpy, Basemap, hashlib, os, tempfile
+    Example:
+        ...
+    """
+    import os, tempfile, hashlib
+    kinds = ['coastlines','countries','states']
+    key = sorted(m.basemap_kwargs.items())+[('resolution',resolution)]
+    key = hashlib.md5(repr(key)).hexdigest()[:16]
+    if cache_dir is None:
+        cache_dir = os.path.join(tempfile.gettempdir(),'moving_lines_map_cache')
+    if cache_dir:
+        fnames = dict((k,[os.path.join(cache_dir,'{}_{}_{}.npy'.format(key,k,v)) for v in ['xy','idx']]) for k in kinds)
+        if all([os.path.isfile(f) for k in kinds for f in fnames[k]]):
+            try:
+                return dict((k,(np.load(fnames[k][0],mmap_mode='r'),np.load(fnames[k][1]))) for k in kinds)
+            except (IOError,ValueError):
+                print '** Problem reading the map cache, rebuilding **'
+    mr = Basemap(resolution=resolution,**m.basemap_kwargs)
+    try:
+        segs = {'coastlines':mr.coastsegs,
+                'countries':mr._readboundarydata('countries')[0],
+                'states':mr._readboundarydata('states')[0]}
+    except (AttributeError,TypeError,KeyError,IndexError):
+        # coastsegs and _readboundarydata are basemap internals, if they change with a basemap version
+        # get the same projected segments from the lines drawn by the public methods on a scratch axes
+        print '** Basemap boundary internals not found, using drawcoastlines/drawcountries/drawstates **'
+        from matplotlib.figure import Figure
+        ax = Figure().add_subplot(111)
+        segs = {'coastlines':mr.drawcoastlines(ax=ax).get_segments(),
+                'countries':mr.drawcountries(ax=ax).get_segments(),
+                'states':mr.drawstates(ax=ax).get_segments()}
+    b = {}
+    for k in kinds:
+        idx = np.cumsum([0]+[len(sg) for sg in segs[k]])
+        if len(segs[k]):
+            xy = np.vstack([np.asarray(sg,dtype=float) for sg in segs[k]])
+        else:
+            xy = np.zeros((0,2))
+        b[k] = (xy,idx)
+    if cache_dir:
         try:
-            a.remove()
-        except AttributeError:
-            for b in a.values():
-                try:
-                    b.remove()
-                except:
-                    for c in b:
-                        try:
-                            c.remove()
-                        except:
-                            for d in c:
-                                try:
-                                    d.remove()
-                                except:
-                                    r = r+1
-
-    m.artists = []
-    m.artists.append(m.drawmeridians(meridians,labels=[0,0,0,1]))
-    m.artists.append(m.drawparallels(parallels,labels=[1,0,0,0]))
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            for k in kinds:
+                np.save(fnames[k][0],b[k][0])
+                np.save(fnames[k][1],b[k][1])
+        except (IOError,OSError):
+            print '** Unable to save the map cache to {} **'.format(cache_dir)
+    return b
+
+def draw_map_boundaries(m,boundaries):
+    """
+    Simple program to draw the coastlines, countries and states from the map_boundaries geometries
+    Reuses the line collections in m.boundary_artists if they exist, only changing their segments
+    """
+    from matplotlib.collections import LineCollection
+    ax = m._check_ax()
+    widths = {'coastlines':1.0,'countries':0.5,'states':0.5}
+    for k,(xy,idx) in boundaries.items():
+        segs = [xy[i0:i1] for i0,i1 in zip(idx[:-1],idx[1:])]
+        if k in m.boundary_artists:
+            m.boundary_artists[k].set_segments(segs)
+        else:
+            lc = LineCollection(segs,antialiaseds=(1,))
+            lc.set_color('k')
+            lc.set_linewidth(widths[k])
+            lc.set_label('_nolabel_')
+            ax.add_collection(lc)
+            m.boundary_artists[k] = lc
+
+lod_resolutions = [(60.0,'c'),(20.0,'l'),(5.0,'i'),(1.0,'h')]
+
+def lod_resolution(m,xlim=None,ylim=None):
+    """
+    Simple program to choose the level of detail of the coastlines from the extent of the axes (or of xlim and ylim)
+    Returns the basemap resolution of the first of lod_resolutions that has a smaller extent in degrees, 'f' if none
+    """
+    ax = m._check_ax()
+    if xlim is None:
+        xlim = ax.get_xlim()
+    if ylim is None:
+        ylim = ax.get_ylim()
+    lon,lat = m(np.array(xlim,dtype=float),np.array(ylim,dtype=float),inverse=True)
+    span = max(abs(lon[1]-lon[0]),abs(lat[1]-lat[0]))
+    for s,res in lod_resolutions:
+        if span>s:
+            return res
+    return 'f'
+
+def update_map_resolution(m,resolution=None):
+    """
+    Program to switch the drawn coastlines, countries and states to the resolution (default from lod_resolution)
+    The geometries of each resolution are only read once, and kept in m.boundaries
+    Returns True if the resolution was changed
+    """
+    if not resolution:
+        resolution = lod_resolution(m)
+    if resolution==m.boundary_resolution:
+        return False
+    if resolution not in m.boundaries:
+        m.boundaries[resolution] = map_boundaries(m,resolution=resolution,cache_dir=m.cache_dir)
+    draw_map_boundaries(m,m.boundaries[resolution])
+    m.boundary_resolution = resolution
+    return True
+
+def update_pars_mers(m,meridians,parallels):
+    'Simple program to update the meridians and parallels, reusing the graticule artists'
+    if not hasattr(m,'graticule'):
+        m.graticule = graticule(m)
+    m.graticule.update(meridians,parallels)
+
+class graticule(object):
+    """
+    Purpose:
+        Draw the meridians and parallels (with their labels) of a basemap, keeping a pool of line and label artists
+        At each update, only the meridians and parallels visible in the current axes are calculated, 
+        and the artists are moved in place (hidden when not needed), instead of removing and redrawing the basemap grid
+    Inputs: (at init)
+        m: basemap instance
+        npts: (default 100) number of points along each line
+        color, linewidth, dashes, fontsize: (optional) style of the lines and labels, same defaults as basemap
+    Outputs:
+        graticule class
+    Dependencies:
+        numpy, matplotlib
+    Example:
+        g = graticule(m)
+        g.update(np.arange(-20,25,5),np.arange(-30,15,5))
+    """
+    def __init__(self,m,npts=100,color='k',linewidth=1.0,dashes=[1,1],fontsize=None):
+        self.m = m
+        self.ax = m._check_ax()
+        self.npts = npts
+        self.color = color
+        self.linewidth = linewidth
+        self.dashes = dashes
+        self.fontsize = fontsize
+        self.lines = {'mer':[],'par':[]}
+        self.labels = {'mer':[],'par':[]}
+
+    def extent(self):
+        'returns the longitude and latitude range of the current axes view'
+        xlim,ylim = self.ax.get_xlim(),self.ax.get_ylim()
+        x,y = np.meshgrid(np.linspace(xlim[0],xlim[1],9),np.linspace(ylim[0],ylim[1],9))
+        lon,lat = self.m(x.flatten(),y.flatten(),inverse=True)
+        lon,lat = np.array(lon),np.array(lat)
+        i = (np.abs(lon)<=360.0)&(np.abs(lat)<=90.0)
+        return (lon[i].min(),lon[i].max()),(lat[i].min(),lat[i].max())
+
+    def update(self,meridians,parallels):
+        'Method to move the meridians and parallels artists to the visible meridians and parallels'
+        lonr,latr = self.extent()
+        xlim,ylim = self.ax.get_xlim(),self.ax.get_ylim()
+        meridians = [mr for mr in meridians if lonr[0]<=mr<=lonr[1]]
+        parallels = [pr for pr in parallels if latr[0]<=pr<=latr[1]]
+        lats = np.linspace(max(latr[0]-1.0,-90.0),min(latr[1]+1.0,90.0),self.npts)
+        lons = np.linspace(lonr[0]-1.0,lonr[1]+1.0,self.npts)
+        for i,mr in enumerate(meridians):
+            x,y = self.m(lats*0.0+mr,lats)
+            x,y = np.array(x),np.array(y)
+            self.set_line('mer',i,x,y,np.interp(ylim[0],y,x),ylim[0]-0.01*(ylim[1]-ylim[0]),self.label_lon(mr))
+        for i,pr in enumerate(parallels):
+            x,y = self.m(lons,lons*0.0+pr)
+            x,y = np.array(x),np.array(y)
+            self.set_line('par',i,x,y,xlim[0]-0.01*(xlim[1]-xlim[0]),np.interp(xlim[0],x,y),self.label_lat(pr))
+        for k,n in [('mer',len(meridians)),('par',len(parallels))]:
+            for a in self.lines[k][n:]+self.labels[k][n:]:
+                a.set_visible(False)
+
+    def set_line(self,k,i,x,y,xl,yl,label):
+        'Method to set the i-th line and label of kind k (mer or par), creating the artists if the pool is too small'
+        from matplotlib.lines import Line2D
+        if i>=len(self.lines[k]):
+            l = Line2D(x,y,linewidth=self.linewidth,color=self.color,dashes=self.dashes)
+            l.set_label('_nolabel_')
+            self.ax.add_artist(l)
+            self.lines[k].append(l)
+            if k=='mer':
+                t = self.ax.text(xl,yl,label,ha='center',va='top',fontsize=self.fontsize,clip_on=False)
+            else:
+                t = self.ax.text(xl,yl,label,ha='right',va='center',fontsize=self.fontsize,clip_on=False)
+            self.labels[k].append(t)
+        self.lines[k][i].set_data(x,y)
+        self.labels[k][i].set_position((xl,yl))
+        self.labels[k][i].set_text(label)
+        self.lines[k][i].set_visible(True)
+        self.labels[k][i].set_visible(True)
+
+    def label_lon(self,lon):
+        'returns the label string of a meridian'
+        lon = (lon+180.0)%360.0-180.0
+        if lon>0 and lon<180:
+            return u'%g\u00b0E' %lon
+        elif lon<0:
+            return u'%g\u00b0W' %(-lon)
+        else:
+            return u'%g\u00b0' %abs(lon)
+
+    def label_lat(self,lat):
+        'returns the label string of a parallel'
+        if lat>0:
+            return u'%g\u00b0N' %lat
+        elif lat<0:
+            return u'%g\u00b0S' %(-lat)
+        else:
+            return u'0\u00b0'
+
+_pll_float = re.compile(r'^\s*[-+]?(\d+\.?\d*|\.\d+)\s*$')
+_pll_neg = re.compile('[SWsw]+')
+_pll_pos = re.compile('[NEne]+')
+_pll_cache = {}
 
 def pll(string):
     """
@@ -552,7 +955,18 @@ def pll(string):
     function that parses a string and converts it to lat lon values
     one space indicates seperation between degree, minutes, or minutes and seconds
     returns decimal degrees
+    if string is a list, tuple or numpy array (of strings or numbers), returns a numpy float array of the same shape
+    parsed strings are kept in a memo cache (_pll_cache)
     """
+    if isinstance(string,(list,tuple,np.ndarray)) and np.ndim(string)>0:
+        # decimal degrees are converted in one call, any other format (or nan) goes through each value
+        try:
+            deg = np.array(string,dtype=np.float64)
+            if not np.isnan(deg).any():
+                return deg
+        except (ValueError,TypeError):
+            pass
+        return np.array([pll(s) for s in np.asarray(string,dtype=object).flat],dtype=np.float64).reshape(np.shape(string))
     if type(string) is float:
         return string
     if type(string) is int:
@@ -563,47 +977,102 @@ def pll(string):
         except TypeError:
             print 'Error with pll input, trying to return first value'
             return float(string[0])
-    n = len(string.split())
-    str_ls = string.split()
-    char_neg = re.findall("[SWsw]+",str_ls[-1])
-    char_pos = re.findall("[NEne]+",str_ls[-1])
-    if len(char_neg)>0:
-        sign = -1
-        cr = char_neg[0]
-    elif len(char_pos)>0:
-        sign = 1
-        cr = char_pos[0]
+    try:
+        return _pll_cache[string]
+    except KeyError:
+        pass
+    if _pll_float.match(string):
+        deg = float(string)
     else:
-        sign = 1
-        cr = ''
-    str_ls[-1] = str_ls[-1].strip(cr)
-    deg = float(str_ls[0])*sign
-    deg_m = 0.0
-    for i in range(n-1,0,-1):
-        deg_m = deg_m/60.0
-        if str_ls[i]:
-            deg_m = deg_m + float(str_ls[i])/60.0
-    return deg+(deg_m*sign)
-
-def plot_map_labels(m,filename,marker=None,skip_lines=0,color='k'):
+        n = len(string.split())
+        str_ls = string.split()
+        char_neg = _pll_neg.findall(str_ls[-1])
+        char_pos = _pll_pos.findall(str_ls[-1])
+        if len(char_neg)>0:
+            sign = -1
+            cr = char_neg[0]
+        elif len(char_pos)>0:
+            sign = 1
+            cr = char_pos[0]
+        else:
+            sign = 1
+            cr = ''
+        str_ls[-1] = str_ls[-1].strip(cr)
+        deg = float(str_ls[0])*sign
+        deg_m = 0.0
+        for i in range(n-1,0,-1):
+            deg_m = deg_m/60.0
+            if str_ls[i]:
+                deg_m = deg_m + float(str_ls[i])/60.0
+        deg = deg+(deg_m*sign)
+    if len(_pll_cache)<100000:
+        _pll_cache[string] = deg
+    return deg
+
+def plot_map_labels(m,filename,marker=None,skip_lines=0,color='k',max_labels=40):
     """
     program to plot the map labels on the basemap plot defined by m
     if marker is set, then it will be the default for all points in file
+    The points are projected once and sorted in x, as an index to find the points in view (see update_map_labels),
+    only the points in view are plotted, with one line object per marker, 
+    and the text labels are only added when there are less than max_labels points in view
+    The label layers are kept in m.map_labels to be updated after a zoom or pan
     """
     labels = mi.load_map_labels(filename,skip_lines=skip_lines) 
-    for l in labels:
-        try:
-            x,y = m(l['lon'],l['lat'])
-            xtxt,ytxt = m(l['lon']+0.05,l['lat'])
-        except:
-            x,y = l['lon'],l['lat']
-            xtxt,ytxt = l['lon']+0.05,l['lat']
-        if marker:
-            ma = marker
-        else:
-            ma = l['marker'] 
-        m.plot(x,y,color=color,marker=ma)
-        m.ax.annotate(l['label'],(xtxt,ytxt))
+    if not labels:
+        return
+    lon = np.array([l['lon'] for l in labels])
+    lat = np.array([l['lat'] for l in labels])
+    try:
+        x,y = m(lon,lat)
+        xtxt,ytxt = m(lon+0.05,lat)
+    except:
+        x,y = lon,lat
+        xtxt,ytxt = lon+0.05,lat
+    if marker:
+        ma = np.array([marker]*len(labels))
+    else:
+        ma = np.array([l['marker'] for l in labels])
+    i = np.argsort(x)
+    lb = {'x':np.asarray(x)[i],'y':np.asarray(y)[i],'xtxt':np.asarray(xtxt)[i],'ytxt':np.asarray(ytxt)[i],
+          'marker':ma[i],'label':np.array([l['label'] for l in labels])[i],'max_labels':max_labels,
+          'points':{},'texts':[]}
+    for mk in np.unique(ma):
+        lb['points'][mk], = m.ax.plot([],[],color=color,marker=mk,linestyle='None')
+    if not hasattr(m,'map_labels'):
+        m.map_labels = []
+    m.map_labels.append(lb)
+    update_map_labels(m,[lb])
+
+def update_map_labels(m,layers=None):
+    """
+    Program to show only the map labels points (default all layers of m.map_labels) that are in the current view
+    The points in view are found with a binary search on the sorted x, then the y range, 
+    and the text artists are reused from one update to the next
+    """
+    ax = m.ax
+    xlim,ylim = sorted(ax.get_xlim()),sorted(ax.get_ylim())
+    if layers is None:
+        layers = getattr(m,'map_labels',[])
+    for lb in layers:
+        i0,i1 = np.searchsorted(lb['x'],xlim)
+        i = np.arange(i0,i1)
+        i = i[(lb['y'][i]>=ylim[0])&(lb['y'][i]<=ylim[1])]
+        for mk,p in lb['points'].items():
+            im = i[lb['marker'][i]==mk]
+            p.set_data(lb['x'][im],lb['y'][im])
+        if len(i)>lb['max_labels']:
+            i = i[:0]
+        for j,k in enumerate(i):
+            if j<len(lb['texts']):
+                lb['texts'][j].xy = (lb['xtxt'][k],lb['ytxt'][k])
+                lb['texts'][j].set_position((lb['xtxt'][k],lb['ytxt'][k]))
+                lb['texts'][j].set_text(lb['label'][k])
+                lb['texts'][j].set_visible(True)
+            else:
+                lb['texts'].append(ax.annotate(lb['label'][k],(lb['xtxt'][k],lb['ytxt'][k])))
+        for t in lb['texts'][len(i):]:
+            t.set_visible(False)
 
 def load_map_labels(filename,skip_lines=0):
     """
@@ -611,7 +1080,7 @@ def load_map_labels(filename,skip_lines=0):
     with format: Label, lon, lat, style
     returns list of dictionary with each key as the label
     """
-    out = []
+    rows = []
     with open(filename,'r') as f:
         for i in range(skip_lines):
             next(f)
@@ -619,104 +1088,230 @@ def load_map_labels(filename,skip_lines=0):
             sp = line.split(',')
             if sp[0].startswith('#'):
                 continue
-            out.append({'label':sp[0],'lon':mi.pll(sp[1]),'lat':mi.pll(sp[2]),'marker':sp[3].rstrip('\n')})
-    return out
+            rows.append(sp)
+    lon = mi.pll([sp[1] for sp in rows])
+    lat = mi.pll([sp[2] for sp in rows])
+    return [{'label':sp[0],'lon':lon[i],'lat':lat[i],'marker':sp[3].rstrip('\n')} for i,sp in enumerate(rows)]
 
-def load_sat_from_net():
+def load_sat_from_net(datestr):
     """
     Program to load the satllite track prediction from the internet
     Checks at the avdc website
+    The kml is read and parsed (with get_sat_tracks) while downloading, and if that fails the previous day's prediction is tried
+    Returns the satellite tracks of the day datestr, or None if neither prediction could be downloaded and read
     """
     from datetime import datetime,timedelta
     from urllib2 import urlopen
-    from pykml import parser
-    today = datetime.now().strftime('%Y%m%d')
-    site = 'http://avdc.gsfc.nasa.gov/download_2.php?site=98675770&id=25&go=download&path=%2FSubsatellite%2Fkml&file=A-Train_subsatellite_prediction_'+today+'T000000Z.kml'
-    print 'Satellite tracks url: %s' %site
-    try:
-        response = urlopen(site)
-        print 'Getting the kml prediction file from avdc.gsfc.nasa.gov'
-        r = response.read()
-        kml = parser.fromstring(r)
-    except:
-        print 'Problem with day, trying previous day...'
+    for i,day in enumerate([datetime.now(),datetime.now()-timedelta(days=1)]):
+        if i>0:
+            print 'Problem with day, trying previous day...'
+        site = 'http://avdc.gsfc.nasa.gov/download_2.php?site=98675770&id=25&go=download&path=%2FSubsatellite%2Fkml&file=A-Train_subsatellite_prediction_'+day.strftime('%Y%m%d')+'T000000Z.kml'
+        print 'Satellite tracks url: %s' %site
         try:
-            yesterday = (datetime.now()-timedelta(days=1)).strftime('%Y%m%d')
-            site = 'http://avdc.gsfc.nasa.gov/download_2.php?site=98675770&id=25&go=download&path=%2FSubsatellite%2Fkml&file=A-Train_subsatellite_prediction_'+yesterday+'T000000Z.kml'
             response = urlopen(site)
             print 'Getting the kml prediction file from avdc.gsfc.nasa.gov'
-            r = response.read()
-            kml = parser.fromstring(r)
-        except:
-            import tkMessageBox
-            tkMessageBox.showerror('No sat','There was an error communicating with avdc.gsfc.nasa.gov')
-            return None
-    print 'Kml file read...'
-    return kml
+            sat = get_sat_tracks(datestr,response)
+            response.close()
+        except Exception as ie:
+            print '** Problem with the download: %s **' %ie
+            sat = None
+        if sat is not None:
+            print 'Kml file read...'
+            return sat
+    import tkMessageBox
+    tkMessageBox.showerror('No sat','There was an error communicating with avdc.gsfc.nasa.gov')
+    return None
 
 def load_sat_from_file(filename):
     """
     Program to load the satellite track prediction from a saved file
+    Returns the opened file, to be read by get_sat_tracks
     """
-    from pykml import parser
-    f = open(filename,'r')
-    r = f.read()
-    kml = parser.fromstring(r)
-    return kml
+    return open(filename,'rb')
 
 def get_sat_tracks(datestr,kml):
     """
     Program that goes and fetches the satellite tracks for the day
     For the day defined with datestr
-    kml is the parsed kml structure with pykml
+    kml is the opened kml file (or url) of the A-Train prediction, or its filename
+    Returns None if the kml could not be read to its end (truncated file or broken download)
+    The kml is read as a stream (iterparse), keeping only the placemarks of the day, 
+    with the coordinates converted to arrays in one call, the other elements are cleared as they are read
     """
-    from map_interactive import pll
+    import httplib
+    try:
+        import xml.etree.cElementTree as et
+    except ImportError:
+        import xml.etree.ElementTree as et
     sat = dict()
     # properly format datestr
     day = datestr.replace('-','')
-    for i in range(4):
-        name = str(kml.Document.Document[i].name).split(':')[1].lstrip(' ')
-        for j in range(1,kml.Document.Document[i].countchildren()-1):
-            if str(kml.Document.Document[i].Placemark[j].name).find(day) > 0:
-                pos_str = str(kml.Document.Document[i].Placemark[j].LineString.coordinates)
-                post_fl = pos_str.split(' ')
-                lon,lat = [],[]
-                for s in post_fl:
-                    try:
-                        x,y = s.split(',')
-                        lon.append(pll(x))
-                        lat.append(pll(y))
-                    except:
-                        pass
-        try:
-            sat[name] = (lon,lat)
-        except UnboundLocalError:
-            print 'Skipping %s; no points downloaded' %name
+    tag = lambda e: e.tag.split('}')[-1]
+    names,tracks = [],[]
+    try:
+        for event,e in et.iterparse(kml,events=('start','end')):
+            if event=='start':
+                if tag(e)=='Document':
+                    names.append('')
+                    tracks.append([])
+                continue
+            t = tag(e)
+            if t=='name' and not names[-1]:
+                names[-1] = (e.text or '').split(':')[-1].lstrip(' ')
+            elif t=='Placemark':
+                name = [c for c in e if tag(c)=='name']
+                if name and (name[0].text or '').find(day)>0:
+                    for c in e.iter():
+                        if tag(c)=='coordinates' and c.text:
+                            pos = c.text.split()
+                            n = pos[0].count(',')+1
+                            pos = np.fromstring(' '.join(pos).replace(',',' '),sep=' ')
+                            tracks[-1].append(pos[:len(pos)/n*n].reshape(-1,n)[:,:2])
+                e.clear()
+            elif t=='Document':
+                name,track = names.pop(),tracks.pop()
+                if track:
+                    track = np.vstack(track)
+                    sat[name] = (track[:,0],track[:,1])
+                elif names:
+                    print 'Skipping %s; no points downloaded' %name
+                e.clear()
+    except (SyntaxError,IOError,httplib.HTTPException) as ie:
+        print '** Problem reading the kml file: %s **' %ie
+        return None
+    return sat
+
+def get_sat_tracks_from_kml(datestr,filename=None,cache_dir=None):
+    """
+    Program to get the satellite tracks of the day datestr from the A-Train kml prediction file, 
+    loaded from the internet (load_sat_from_net) or from filename (load_sat_from_file)
+    The tracks are kept in the cache (see load_sat_cache) keyed by the kml file content 
+    (or by the day of the prediction when loaded from the internet), so that the kml is not downloaded or parsed again
+    Returns None if the kml file could not be loaded or read, nothing is cached in that case
+    """
+    from datetime import datetime
+    if filename:
+        f = open(filename,'rb')
+        key = sat_cache_key(iter(lambda: f.read(1048576),''),datestr)
+        f.close()
+    else:
+        key = sat_cache_key(['avdc A-Train prediction',datetime.now().strftime('%Y%m%d')],datestr)
+    sat = load_sat_cache(key,cache_dir=cache_dir)
+    if sat:
+        return sat
+    if filename:
+        kml = load_sat_from_file(filename)
+        sat = get_sat_tracks(datestr,kml)
+        kml.close()
+    else:
+        sat = load_sat_from_net(datestr)
+    if sat is None:
+        return None
+    save_sat_cache(key,sat,cache_dir=cache_dir)
+    return sat
+
+sat_cache_size = 30 # maximum number of track files kept in the satellite tracks cache
+
+def sat_cache_key(lines,*args):
+    'Program to build the key (hash) of the satellite tracks cache from the source lines (tle or kml) and the other arguments'
+    import hashlib
+    h = hashlib.md5()
+    for l in lines:
+        h.update(l)
+    h.update(repr(args))
+    return h.hexdigest()
+
+def load_sat_cache(key,cache_dir=None):
+    """
+    Program to load the satellite tracks saved by save_sat_cache, returns None if not in the cache
+    The cache is a directory of compressed numpy files (moving_lines_sat_cache in the temp directory by default),
+    the file access time is updated at each read, for removing the least recently used files
+    """
+    import os, tempfile
+    if cache_dir is False:
+        return None
+    if cache_dir is None:
+        cache_dir = os.path.join(tempfile.gettempdir(),'moving_lines_sat_cache')
+    f = os.path.join(cache_dir,key+'.npz')
+    if not os.path.isfile(f):
+        return None
+    try:
+        c = np.load(f)
+        sat = {}
+        for i,k in enumerate(c['names']):
+            k = str(k)
+            if 'd' in c.files:
+                import ephem
+                sat[k] = {'tle1':str(c['tle1'][i]),'tle2':str(c['tle2'][i]),
+                          'd':[ephem.Date(x) for x in c['d']],'lat':c['lat%i'%i],'lon':c['lon%i'%i]}
+            else:
+                sat[k] = (c['lon%i'%i],c['lat%i'%i])
+        c.close()
+        os.utime(f,None)
+    except (IOError,ValueError,KeyError):
+        print '** Problem reading the satellite tracks cache file: {} **'.format(f)
+        return None
     return sat
 
-def plot_sat_tracks(m,sat): 
+def save_sat_cache(key,sat,cache_dir=None):
+    """
+    Program to save the satellite tracks (from get_sat_tracks or get_sat_tracks_from_tle) to the cache under key
+    Removes the least recently used files when there are more than sat_cache_size files
+    """
+    import os, tempfile
+    if cache_dir is False or not sat:
+        return
+    if cache_dir is None:
+        cache_dir = os.path.join(tempfile.gettempdir(),'moving_lines_sat_cache')
+    names = sorted(sat.keys())
+    c = {'names':np.array(names)}
+    for i,k in enumerate(names):
+        if type(sat[k]) is dict:
+            c['lat%i'%i],c['lon%i'%i] = np.asarray(sat[k]['lat'],dtype=float),np.asarray(sat[k]['lon'],dtype=float)
+            c['d'] = np.array(sat[k]['d'],dtype=float)
+            c['tle1'] = np.array([sat[n]['tle1'] for n in names])
+            c['tle2'] = np.array([sat[n]['tle2'] for n in names])
+        else:
+            c['lon%i'%i],c['lat%i'%i] = np.asarray(sat[k][0],dtype=float),np.asarray(sat[k][1],dtype=float)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        np.savez_compressed(os.path.join(cache_dir,key+'.npz'),**c)
+        files = [os.path.join(cache_dir,f) for f in os.listdir(cache_dir) if f.endswith('.npz')]
+        files.sort(key=os.path.getmtime)
+        for f in files[:-sat_cache_size]:
+            os.remove(f)
+    except (IOError,OSError):
+        print '** Unable to save the satellite tracks cache to {} **'.format(cache_dir)
+
+def plot_sat_tracks(m,sat,label_spacing=60.0): 
     """
     Program that goes through and plots the satellite tracks
+    Each track is projected once, and only the part inside the current map view is drawn (see update_sat_tracks), 
+    tracks are kept in m.sat_tracks so that update_sat_tracks can clip them again after a zoom or pan
+    label_spacing: (default 60) minimum distance in pixels between two time labels along a track
+    Returns the list of plotted artists (lines, time labels, and legend)
     """
-    import map_utils as mu
     sat_obj = []
+    if not hasattr(m,'sat_tracks'):
+        m.sat_tracks = []
     for k in sat.keys():
         if type(sat[k]) is dict:
             lon = sat[k]['lon']
             lat = sat[k]['lat']
         else:
             (lon,lat) = sat[k]
+        lon,lat = np.asarray(lon,dtype=float),np.asarray(lat,dtype=float)
         x,y = m(lon,lat)
-        sat_obj.append(m.plot(x,y,'.',label=k))
-        co = sat_obj[-1][-1].get_color()
-        #sat_obj.append(mu.mplot_spec(m,lon,lat,'-',linewidth=0.2))
+        line, = m.plot([],[],'.',label=k)
+        t = {'lon':lon,'x':np.asarray(x),'y':np.asarray(y),'line':line,'labels':[],'label_spacing':label_spacing}
         if type(sat[k]) is dict:
-            latrange = [m.llcrnrlat,m.urcrnrlat]
-            lonrange = [m.llcrnrlon,m.urcrnrlon]
-            for i,d in enumerate(sat[k]['d']):
-                if not i%20:
-                    if ((lat[i]>=latrange[0])&(lat[i]<=latrange[1])&(lon[i]>=lonrange[0])&(lon[i]<=lonrange[1])):
-                        sat_obj.append(m.ax.text(x[i],y[i],'%02i:%02i' % (d.tuple()[3],d.tuple()[4]),color=co))
+            # minutes of the day, ephem dates start at noon
+            t['minutes'] = np.floor((np.asarray(sat[k]['d'],dtype=float)+0.5)%1.0*1440.0+1.0E-6).astype(int)
+        m.sat_tracks.append(t)
+        sat_obj.append(line)
+        update_sat_tracks(m,[t])
+        sat_obj.extend(t['labels'])
     if len(sat.keys())>4:
         ncol = 2
     else:
@@ -724,31 +1319,98 @@ def plot_sat_tracks(m,sat):
     sat_obj.append(m.ax.legend(loc='lower right',bbox_to_anchor=(1.0,1.04),ncol=ncol))
     return sat_obj
 
-def get_sat_tracks_from_tle(datestr):
+def update_sat_tracks(m,tracks=None):
+    """
+    Program to clip the satellite tracks (default all of m.sat_tracks) to the current map view
+    Keeps the points inside the axes and their neighbors, with breaks (NaN) between the separate parts 
+    and where the track crosses the dateline, then places the time labels (HH:MM) inside the view 
+    spaced by at least the label_spacing of the track in pixels, reusing the text artists
+    """
+    ax = m.ax
+    xlim,ylim = sorted(ax.get_xlim()),sorted(ax.get_ylim())
+    if tracks is None:
+        tracks = getattr(m,'sat_tracks',[])
+    for t in tracks:
+        x,y = t['x'],t['y']
+        inside = (x>=xlim[0])&(x<=xlim[1])&(y>=ylim[0])&(y<=ylim[1])
+        keep = inside.copy()
+        keep[1:] |= inside[:-1]
+        keep[:-1] |= inside[1:]
+        ik, = np.where(keep)
+        brk, = np.where((np.diff(ik)>1)|(np.abs(np.diff(t['lon'][ik]))>180.0))
+        t['line'].set_data(np.insert(x[ik],brk+1,np.nan),np.insert(y[ik],brk+1,np.nan))
+        if 'minutes' not in t:
+            continue
+        ii, = np.where(inside)
+        il = []
+        if len(ii):
+            xy = ax.transData.transform(np.vstack([x[ii],y[ii]]).T)
+            ds = np.sqrt((np.diff(xy,axis=0)**2).sum(axis=1))
+            ds[np.diff(ii)>1] = t['label_spacing'] # new label after each break
+            n = np.floor(np.concatenate([[0.0],np.cumsum(ds)])/t['label_spacing'])
+            il = ii[np.concatenate([[True],np.diff(n)>0])]
+        co = t['line'].get_color()
+        for j,i in enumerate(il):
+            hm = '%02i:%02i' % (t['minutes'][i]/60,t['minutes'][i]%60)
+            if j<len(t['labels']):
+                t['labels'][j].set_position((x[i],y[i]))
+                t['labels'][j].set_text(hm)
+                t['labels'][j].set_visible(True)
+            else:
+                t['labels'].append(ax.text(x[i],y[i],hm,color=co))
+        for lb in t['labels'][len(il):]:
+            lb.set_visible(False)
+
+def remove_sat_tracks(m):
+    'Program to remove all the satellite tracks lines and time labels plotted by plot_sat_tracks'
+    for t in getattr(m,'sat_tracks',[]):
+        for a in [t['line']]+t['labels']:
+            try:
+                a.remove()
+            except ValueError:
+                pass
+    m.sat_tracks = []
+
+def get_sat_tracks_from_tle(datestr,step=0.5,window=24.0,cache_dir=None):
     """
     Program to build the satellite tracks from the two line element file
+    All satellites are propagated at once for all times with the vectorized SGP4 of map_utils (sgp4_latlon),
+    deep space satellites, not handled by sgp4_latlon, are calculated with ephem
+    step: (default 0.5) time step between track points, in minutes
+    window: (default 24) time span of the tracks starting at 00:00 UTC of datestr, in hours
+    cache_dir: (optional) directory of the tracks cache (see load_sat_cache), if False does not use the cache
+    The tracks are kept in the cache keyed by the two line elements, datestr, step and window
     """
     import ephem
     import numpy as np
     from map_interactive import get_tle_from_file
+    from map_utils import sgp4_latlon
     try:
         sat = get_tle_from_file('.\sat.tle')
     except:
         import tkMessageBox
         tkMessageBox.showerror('No sat','There was an error reading the sat.tle file')
         return None
-    for k in sat.keys():
-        sat[k]['ephem'] = ephem.readtle(k,sat[k]['tle1'],sat[k]['tle2'])
-        sat[k]['d'] = [ephem.Date(datestr+' 00:00')]
-        sat[k]['ephem'].compute(sat[k]['d'][0])
-        sat[k]['lat'] = [np.rad2deg(sat[k]['ephem'].sublat)]
-        sat[k]['lon'] = [np.rad2deg(sat[k]['ephem'].sublong)]
-        for t in xrange(24*60*2):
-            d = ephem.Date(sat[k]['d'][t]+ephem.minute/2.0)
-            sat[k]['d'].append(d)
-            sat[k]['ephem'].compute(d)
-            sat[k]['lat'].append(np.rad2deg(sat[k]['ephem'].sublat))
-            sat[k]['lon'].append(np.rad2deg(sat[k]['ephem'].sublong))
+    names = sorted(sat.keys())
+    key = sat_cache_key([k+sat[k]['tle1']+sat[k]['tle2'] for k in names],datestr,step,window)
+    sat_c = load_sat_cache(key,cache_dir=cache_dir)
+    if sat_c:
+        return sat_c
+    d = ephem.Date(datestr+' 00:00')+np.arange(int(round(window*60.0/step))+1)*step*ephem.minute
+    # ephem dates are days from 1899-12-31 12:00 UT
+    lat,lon = sgp4_latlon([sat[k]['tle1'] for k in names],[sat[k]['tle2'] for k in names],d+2415020.0)
+    dates = [ephem.Date(x) for x in d]
+    for i,k in enumerate(names):
+        sat[k]['d'] = dates
+        if np.isnan(lat[i,0]):
+            sat[k]['ephem'] = ephem.readtle(k,sat[k]['tle1'],sat[k]['tle2'])
+            for j,x in enumerate(dates):
+                sat[k]['ephem'].compute(x)
+                lat[i,j] = np.rad2deg(sat[k]['ephem'].sublat)
+                lon[i,j] = np.rad2deg(sat[k]['ephem'].sublong)
+        sat[k]['lat'] = lat[i,:]
+        sat[k]['lon'] = lon[i,:]
+    save_sat_cache(key,sat,cache_dir=cache_dir)
     return sat
 
 def get_tle_from_file(filename):
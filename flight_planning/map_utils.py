@@ -64,155 +64,165 @@ def bearing(pos1,pos2):
 
 # In[2]:
 
-def map_ind(mod_lon,mod_lat,meas_lon,meas_lat,meas_good=None):
-    """ Run to get indices in the measurement space of all the closest mod points. Assuming earth geometry."""
-    from map_utils import spherical_dist
-    from Sp_parameters import startprogress, progress, endprogress
+def map_ind(mod_lon,mod_lat,meas_lon,meas_lat,meas_good=None,max_dist=None):
+    """
+    Run to get indices in the measurement space of all the closest mod points. Assuming earth geometry.
+    The closest points are found with a KD-tree of the mod points as unit vectors on the sphere
+    (the closest in straight line distance is the closest in great circle distance)
+    Note: these are the true great circle nearest points. The previous search gave the distances in lon,lat order to
+    spherical_dist (which expects lat,lon), so results can differ from runs before this change (about 1 in 10 points 
+    on a mid latitude grid). Only the mod points within the +/- 0.02 (or 0.2) degrees box around the measurements 
+    are searched, so a point outside that box is never picked, even if it is closer
+    meas_good: (optional) indices (or boolean array) of the measurements to use, defaults to where meas_lon is not zero
+    max_dist: (optional) maximum distance in km, the measurements without a mod point closer than that get an index of -1
+    Returns the array of the mod indices (one row per dimension of mod_lon) for each good measurement, 
+    or an empty list if no mod points are within 0.2 degrees of the measurements
+    """
+    from scipy.spatial import cKDTree
+    from map_utils import lonlat2xyz
     import numpy as np
-    try:
-        if not meas_good:
-            meas_good = np.where(meas_lon)
-    except ValueError:
-        if not meas_good.any():
-            meas_good = np.where(meas_lon)
-        
-    imodis = np.logical_and(np.logical_and(mod_lon>min(meas_lon[meas_good])-0.02 , mod_lon<max(meas_lon[meas_good])+0.02),
-                            np.logical_and(mod_lat>min(meas_lat[meas_good])-0.02 , mod_lat<max(meas_lat[meas_good])+0.02))
-    wimodis = np.where(imodis)
-    if not wimodis[0].any():
-        print '** No points found within range +/- 0.02 in lat and lon, Extending range to +/- 0.2 **'
-        imodis = np.logical_and(np.logical_and(mod_lon>min(meas_lon[meas_good])-0.2 , mod_lon<max(meas_lon[meas_good])+0.2),
-                                np.logical_and(mod_lat>min(meas_lat[meas_good])-0.2 , mod_lat<max(meas_lat[meas_good])+0.2))
-        wimodis = np.where(imodis)
-        if not wimodis[0].any():
-            print '** No points found in extended range, returning null **'
-            return []
-    N1 = mod_lon[imodis].size
-    modis_grid = np.hstack([mod_lon[imodis].reshape((N1,1)),mod_lat[imodis].reshape((N1,1))])
-    try:
-        N2 = len(meas_good)
-        if N2==1 or N2==2:
-            meas_good = meas_good[0]
-            N2 = len(meas_good)
-        meas_grid = np.hstack([np.array(meas_lon[meas_good]).reshape((N2,1)),np.array(meas_lat[meas_good]).reshape((N2,1))])
-    except:
-        import pdb; pdb.set_trace()
-    meas_in = meas_grid.astype(int)
-    meas_ind = np.array([meas_good.ravel()*0,meas_good.ravel()*0])
-    startprogress('Running through flight track')
-    for i in xrange(meas_good.size):
-        d = spherical_dist(meas_grid[i],modis_grid)
-        try:
-            meas_ind[0,i] = wimodis[0][np.argmin(d)]
-        except:
-            import pdb; pdb.set_trace()
-        meas_ind[1,i] = wimodis[1][np.argmin(d)]
-        progress(float(i)/len(meas_good)*100)
-    endprogress()
+    mod_lon,mod_lat = np.asarray(mod_lon),np.asarray(mod_lat)
+    meas_lon,meas_lat = np.asarray(meas_lon),np.asarray(meas_lat)
+    if type(meas_good) is tuple:
+        meas_good = meas_good[0]
+    if meas_good is not None and np.asarray(meas_good).dtype==bool:
+        meas_good = np.where(meas_good)[0] if np.any(meas_good) else None
+    if meas_good is None or not len(meas_good):
+        meas_good = np.where(meas_lon)[0]
+    meas_good = np.asarray(meas_good)
+    lon,lat = meas_lon[meas_good],meas_lat[meas_good]
+    for d in [0.02,0.2]:
+        imodis = (mod_lon>lon.min()-d)&(mod_lon<lon.max()+d)&(mod_lat>lat.min()-d)&(mod_lat<lat.max()+d)
+        if imodis.any():
+            break
+        if d<0.2:
+            print '** No points found within range +/- 0.02 in lat and lon, Extending range to +/- 0.2 **'
+    else:
+        print '** No points found in extended range, returning null **'
+        return []
+    wimodis = np.flatnonzero(imodis)
+    tree = cKDTree(lonlat2xyz(mod_lon.ravel()[wimodis],mod_lat.ravel()[wimodis]))
+    dist,i = tree.query(lonlat2xyz(lon,lat))
+    meas_ind = np.array(np.unravel_index(wimodis[i],mod_lon.shape))
+    if max_dist:
+        meas_ind[:,2.0*6378.1*np.arcsin(dist/2.0)>max_dist] = -1
     return meas_ind
 
 
 # In[ ]:
 
-def radius_m2deg(center_lon,center_lat,radius):
+def radius_m2deg(center_lon,center_lat,radius,r=6378100.0):
     """ 
     Return the radius in lat lon degrees of a circle centered at the points defined by
       center_lon
       center_lat
     with a radius defined in meters by:
       radius
+    on a sphere of radius r (in meters, defaults to the same earth radius as spherical_dist), can use arrays
       
     Dependencies:
         
-        - geopy library
+        - numpy
     """
-    from geopy import Point
-    from geopy.distance import VincentyDistance
-    origin = Point(center_lat,center_lon)
-    destination = VincentyDistance(kilometers=radius/1000.0).destination(origin,0.0)
-    radius_degrees = abs(center_lat-destination.latitude)
-    return radius_degrees
+    import numpy as np
+    return np.degrees(np.asarray(radius,dtype=float)/r)
 
 
 # In[1]:
 
-def stats_within_radius(lat1,lon1,lat2,lon2,x2,radius,subset=True):
+def stats_within_radius(lat1,lon1,lat2,lon2,x2,radius,subset=False,r=6378100.0):
     """
     Run through all points defined by lat1 and lon1 (can be arrays)
     to find the points within defined by lat2 and lon2 that are within a distance in meters defined by radius
+    The distances are great circle distances on a sphere of radius r (in meters, defaults to the same earth radius as spherical_dist),
+    searched as straight line (chord) distances between the points as unit vectors, so valid at any latitude
     lat2, lon2, x2 can be multidimensional, will be flattened first
-    if subset (optional) is set to True, and there are more than 100 points, only every 10th in lat1, lon1 will be used.
+    if subset (optional, default False) is set to True, and there are more than 100 points, only every 10th in lat1, lon1 will be used.
+    The neighbors are flattened in a compressed sparse row index, and the statistics are calculated 
+    for all points at once with reduceat, not looping on each point
     Returns a dicttionary of statistics:
         'index' : array of indices of flattened lat2 and lon2 that are within radius meters of each point of lat1 and lon1
+        'indices', 'indptr' : the same index, flattened: the indices near point i are indices[indptr[i]:indptr[i+1]]
         'std' : array of standard deviation of x2 that are near lat1 and lon1 by radius
         'range' : range of values of x2 near lat1, lon1
         'mean' : mean of values of x2 near lat1, lon1
         'median': median values of x2 near lat1, lon1
     """
     from scipy.spatial import cKDTree
-    from map_utils import radius_m2deg
+    from map_utils import lonlat2xyz
+    from itertools import chain
     import numpy as np
     print 'Setting up the lat, lon, localization'
-    max_distance = radius_m2deg(lon1[0],lat1[0],radius) #transform to degrees
+    max_distance = 2.0*np.sin(min(radius/r,np.pi)/2.0) # chord length of the radius on the unit sphere
     if (len(lat1) > 100) & subset:
-        points_ref = np.column_stack((lat1[::10],lon1[::10]))
-    else:
-        points_ref = np.column_stack((lat1,lon1))
-    if len(lat2.shape) > 1:
-        points = np.column_stack((lat2.reshape(lat2.size),lon2.reshape(lon2.size)))
-        xx = x2.reshape(x2.size)
+        points_ref = lonlat2xyz(lon1[::10],lat1[::10])
     else:
-        points = np.column_stack((lat2,lon2)) 
-        xx = x2
+        points_ref = lonlat2xyz(lon1,lat1)
+    points = lonlat2xyz(np.ravel(lon2),np.ravel(lat2))
+    xx = np.ravel(x2)
     tree = cKDTree(points)
     tree_ref = cKDTree(points_ref)
     out = dict()
     print '... Getting the index points'
     out['index'] = tree_ref.query_ball_tree(tree,max_distance)
-    out['std'] = []
-    out['range'] = []
-    out['mean'] = []
-    out['median'] = []
-    print '... Running through index points'
-    for i in out['index']:
-        if not i:
-            out['std'].append(np.NaN)
-            out['range'].append(np.NaN)
-            out['mean'].append(np.NaN)
-            out['median'].append(np.NaN)
-        else:
-            out['std'].append(np.nanstd(xx[i]))
-            out['range'].append(np.nanmax(xx[i])-np.nanmin(xx[i]))
-            out['mean'].append(np.nanmean(xx[i]))
-            out['median'].append(np.median(xx[i]))
-    out['std'] = np.array(out['std'])
-    out['range'] = np.array(out['range'])
-    out['mean'] = np.array(out['mean'])
-    out['median'] = np.array(out['median'])
+    counts = np.array([len(i) for i in out['index']],dtype=int)
+    out['indptr'] = np.concatenate([[0],np.cumsum(counts)])
+    out['indices'] = np.fromiter(chain.from_iterable(out['index']),dtype=int,count=out['indptr'][-1])
+    print '... Calculating the statistics of the index points'
+    out.update(grouped_stats(np.asarray(xx,dtype=float)[out['indices']],out['indptr']))
     print out.keys()
     return out
 
 
+# In[ ]:
+
+def grouped_stats(v,indptr):
+    """
+    Program to calculate the statistics of the values v grouped by indptr (group i is v[indptr[i]:indptr[i+1]])
+    Returns a dictionary of arrays (one value per group) with the same statistics as
+    nanstd ('std'), nanmax-nanmin ('range'), nanmean ('mean') and median ('median') on each group, 
+    NaN for empty groups, or groups with only NaN
+    """
+    import numpy as np
+    counts = np.diff(indptr)
+    ng = len(counts)
+    out = {'std':np.zeros(ng)+np.nan,'range':np.zeros(ng)+np.nan,'mean':np.zeros(ng)+np.nan,'median':np.zeros(ng)+np.nan}
+    full = counts>0
+    if not full.any():
+        return out
+    start = indptr[:-1][full]
+    group = np.repeat(np.arange(ng),counts)
+    valid = ~np.isnan(v)
+    n = np.add.reduceat(valid,start).astype(float)
+    ok = n>0
+    with np.errstate(invalid='ignore',divide='ignore'):
+        mean = np.add.reduceat(np.where(valid,v,0.0),start)/n
+        dev = np.where(valid,v-mean[(np.cumsum(full)-1)[group]],0.0)
+        std = np.sqrt(np.add.reduceat(dev**2,start)/n)
+    rng = np.maximum.reduceat(np.where(valid,v,-np.inf),start)-np.minimum.reduceat(np.where(valid,v,np.inf),start)
+    out['mean'][full] = np.where(ok,mean,np.nan)
+    out['std'][full] = np.where(ok,std,np.nan)
+    out['range'][full] = np.where(ok,rng,np.nan)
+    # median: sorted values within each group (nan at the end), nan if there is any nan in the group
+    vs = v[np.lexsort((v,group))]
+    c = counts[full]
+    med = 0.5*(vs[start+(c-1)//2]+vs[start+c//2])
+    out['median'][full] = np.where(n==c,med,np.nan)
+    return out
+
+
 # In[3]:
 
 def equi(m, centerlon, centerlat, radius, *args, **kwargs):
     """
     plot a single circle on a map
-    uses the shoot function below
+    uses the shoot function below, with a single call for all the azimuths
     from: http://www.geophysique.be/2011/02/20/matplotlib-basemap-tutorial-09-drawing-circles/
     by: Thomas Lecocq
     """
     from map_utils import shoot
-    glon1 = centerlon
-    glat1 = centerlat
-    X = []
-    Y = []
-    for azimuth in range(0, 360):
-        glon2, glat2, baz = shoot(glon1, glat1, azimuth, radius)
-        X.append(glon2)
-        Y.append(glat2)
-    X.append(X[0])
-    Y.append(Y[0])
+    import numpy as np
+    X,Y,baz = shoot(centerlon,centerlat,np.arange(0,361)%360,radius)
 
     #m.plot(X,Y,**kwargs) #Should work, but doesn't...
     X,Y = m(X,Y)
@@ -226,16 +236,22 @@ def shoot(lon, lat, azimuth, maxdist=None):
     """Shooter Function
     Original javascript on http://williams.best.vwh.net/gccalc.htm
     Translated to python by Thomas Lecocq
+    Vectorized with numpy: lon, lat, azimuth and maxdist can be arrays (broadcasted together), 
+    the iteration runs element-wise on the points not yet converged
+    returns single values when all inputs are single values
     """
     import numpy as np
+    lon,lat,azimuth,maxdist = np.broadcast_arrays(*[np.asarray(v,dtype=float) for v in (lon,lat,azimuth,maxdist)])
+    scalar = lon.ndim==0
+    lon,lat,azimuth,maxdist = [np.atleast_1d(v) for v in (lon,lat,azimuth,maxdist)]
     glat1 = lat * np.pi / 180.
     glon1 = lon * np.pi / 180.
     s = maxdist / 1.852
     faz = azimuth * np.pi / 180.
  
     EPS= 0.00000000005
-    if ((np.abs(np.cos(glat1))<EPS) and not (np.abs(np.sin(faz))<EPS)):
-        alert("Only N-S courses are meaningful, starting at a pole!")
+    if np.any((np.abs(np.cos(glat1))<EPS) & ~(np.abs(np.sin(faz))<EPS)):
+        print "** Only N-S courses are meaningful, starting at a pole! **"
  
     a=6378.13/1.852
     f=1/298.257223563
@@ -243,10 +259,7 @@ def shoot(lon, lat, azimuth, maxdist=None):
     tu = r * np.tan(glat1)
     sf = np.sin(faz)
     cf = np.cos(faz)
-    if (cf==0):
-        b=0.
-    else:
-        b=2. * np.arctan2 (tu, cf)
+    b = np.where(cf==0,0.,2. * np.arctan2 (tu, cf))
  
     cu = 1. / np.sqrt(1 + tu * tu)
     su = tu * cu
@@ -258,19 +271,22 @@ def shoot(lon, lat, azimuth, maxdist=None):
     c = (x * x / 4. + 1.) / c
     d = (0.375 * x * x - 1.) * x
     tu = s / (r * a * c)
-    y = tu
+    y = tu.copy()
     c = y + 1
-    while (np.abs (y - c) > EPS):
+    sy,cy,cz,e = [np.zeros_like(y) for k in range(4)]
+    i = np.abs(y - c) > EPS
+    while np.any(i):
  
-        sy = np.sin(y)
-        cy = np.cos(y)
-        cz = np.cos(b + y)
-        e = 2. * cz * cz - 1.
-        c = y
-        x = e * cy
-        y = e + e - 1.
-        y = (((sy * sy * 4. - 3.) * y * cz * d / 6. + x) *
-              d / 4. - cz) * sy * d + tu
+        sy[i] = np.sin(y[i])
+        cy[i] = np.cos(y[i])
+        cz[i] = np.cos(b[i] + y[i])
+        e[i] = 2. * cz[i] * cz[i] - 1.
+        c[i] = y[i]
+        x = e[i] * cy[i]
+        yy = e[i] + e[i] - 1.
+        y[i] = (((sy[i] * sy[i] * 4. - 3.) * yy * cz[i] * d[i] / 6. + x) *
+                d[i] / 4. - cz[i]) * sy[i] * d[i] + tu[i]
+        i = np.abs(y - c) > EPS
  
     b = cu * cy * cf - su * sy
     c = r * np.sqrt(sa * sa + b * b)
@@ -284,13 +300,43 @@ def shoot(lon, lat, azimuth, maxdist=None):
  
     baz = (np.arctan2(sa, b) + np.pi) % (2 * np.pi)
  
-    glon2 *= 180./np.pi
-    glat2 *= 180./np.pi
-    baz *= 180./np.pi
+    glon2 = glon2*180./np.pi
+    glat2 = glat2*180./np.pi
+    baz = baz*180./np.pi
+    if scalar:
+        return (glon2[0], glat2[0], baz[0])
  
     return (glon2, glat2, baz)
 
 
+# In[ ]:
+
+def lonlat2xyz(lon,lat):
+    'Program to convert lon and lat (degrees, arrays) to unit vectors, returns an array with the x,y,z in the last dimension'
+    import numpy as np
+    lon,lat = np.radians(lon),np.radians(lat)
+    return np.stack([np.cos(lat)*np.cos(lon),np.cos(lat)*np.sin(lon),np.sin(lat)],axis=-1)
+
+
+# In[ ]:
+
+def rotate_unit_vectors(xyz,dlat,dlon):
+    """
+    Program to rotate unit vectors (array of shape (n,3), like from lonlat2xyz), 
+    moving the point at longitude 0 along its meridian by dlat degrees then around the pole by dlon degrees
+    Used to move a geometry calculated once around a point to any other point
+    returns the lon,lat (degrees) of the rotated vectors
+    """
+    import numpy as np
+    t,l = np.radians(dlat),np.radians(dlon)
+    ry = np.array([[np.cos(t),0.0,-np.sin(t)],[0.0,1.0,0.0],[np.sin(t),0.0,np.cos(t)]])
+    rz = np.array([[np.cos(l),-np.sin(l),0.0],[np.sin(l),np.cos(l),0.0],[0.0,0.0,1.0]])
+    v = np.dot(xyz,np.dot(rz,ry).T)
+    lon = np.degrees(np.arctan2(v[:,1],v[:,0]))
+    lat = np.degrees(np.arcsin(np.clip(v[:,2],-1.0,1.0)))
+    return lon,lat
+
+
 # In[ ]:
 
 def great(m, startlon, startlat, azimuth,*args, **kwargs):
@@ -326,6 +372,181 @@ def great(m, startlon, startlat, azimuth,*args, **kwargs):
 # In[1]:
 
 def get_sza_azi(lat,lon,datetime):
+    """
+    Purpose:
+        Calculate the solar zenith angle and the solar azimuth angle for arrays of positions and times in one call
+        Numpy vectorized version of the solar position algorithm (Reda and Andreas, NREL/TP-560-34302) used by pysolar
+        Uses the same VSOP87 earth and nutation tables as pysolar, and the same parallax and sidereal time formulas,
+        so that both the sza and the azimuth stay within 1e-6 degree of pysolar (use get_sza_azi_pysolar for the per-point original)
+        The azimuth error grows as 1/sin(sza) near the zenith, where the azimuth is ill-conditioned, 
+        but it stays within 1e-5 degree of pysolar down to an sza of 0.003 degree
+    Inputs:
+        lat: latitude (degrees North), single value, list or numpy array
+        lon: longitude (degrees East), same size as lat
+        datetime: UTC time, either numpy datetime64 array or a list of datetime objects, same size as lat
+    Outputs:
+        sza: numpy array of solar zenith angle, refraction corrected (degrees)
+        azi: numpy array of solar azimuth angle, in the pysolar convention (180-azimuth from north, add 360 for the angle from north)
+        times that are not valid (NaT) return NaN
+    Dependencies:
+        numpy
+    Example:
+        sza,azi = get_sza_azi(lat,lon,np.datetime64('2015-09-10')+np.arange(3600)*np.timedelta64(1,'s'))
+    """
+    import numpy as np
+    lat = np.radians(np.asarray(lat,dtype=float))
+    lon = np.asarray(lon,dtype=float)
+    t = np.asarray(datetime,dtype='datetime64[us]')
+    # julian day, ephemeris century and millenium
+    jd = np.where(np.isnat(t),np.nan,(t-np.datetime64('2000-01-01T12:00:00','us')).astype(float)/86400.0E6+2451545.0)
+    jc = (jd-2451545.0)/36525.0
+    jce = jc+65.0/86400.0/36525.0 # delta T of 65 seconds
+    jme = jce/10.0
+    # earth heliocentric longitude and radius vector
+    jm = jme[...,np.newaxis]
+    def coef(table):
+        a,b,c = np.array(table).T
+        return (a*np.cos(b+c*jm)).sum(axis=-1)
+    L = (coef(_L0)+coef(_L1)*jme+coef(_L2)*jme**2)/1.0E8
+    R = (coef(_R0)+coef(_R1)*jme+coef(_R2)*jme**2)/1.0E8
+    theta = np.degrees(L)+180.0
+    beta = -(coef(_B0)+coef(_B1)*jme)/1.0E8
+    # nutation in longitude and obliquity
+    x = np.array([297.85036+445267.111480*jce-0.0019142*jce**2+jce**3/189474.0,
+                  357.52772+35999.050340*jce-0.0001603*jce**2-jce**3/300000.0,
+                  134.96298+477198.867398*jce+0.0086972*jce**2+jce**3/56250.0,
+                  93.27191+483202.017538*jce-0.0036825*jce**2+jce**3/327270.0,
+                  125.04452-1934.136261*jce+0.0020708*jce**2+jce**3/450000.0])
+    arg = np.radians(np.tensordot(np.array(_nutation_args,dtype=float),x,axes=(1,0)))
+    a,b,c,d = [k.reshape((-1,)+(1,)*jce.ndim) for k in np.array(_nutation_coefs).T]
+    dpsi = ((a+b*jce)*np.sin(arg)).sum(axis=0)/36000000.0
+    deps = ((c+d*jce)*np.cos(arg)).sum(axis=0)/36000000.0
+    u = jme/10.0
+    eps0 = 84381.448+u*(-4680.93+u*(-1.55+u*(1999.25+u*(-51.38+u*(-249.67+u*(-39.05+u*(7.12+u*(27.87+u*(5.79+u*2.45)))))))))
+    eps = np.radians(eps0/3600.0+deps)
+    # geocentric sun right ascension and declination
+    lamb = np.radians(theta+dpsi-20.4898/(3600.0*R))
+    alpha = np.arctan2(np.sin(lamb)*np.cos(eps)-np.tan(beta)*np.sin(eps),np.cos(lamb))
+    delta = np.arcsin(np.sin(beta)*np.cos(eps)+np.cos(beta)*np.sin(eps)*np.sin(lamb))
+    # apparent sidereal time, nutation correction taken as in pysolar (cosine of the obliquity in degrees) to keep the same values
+    nu = 280.46061837+360.98564736629*(jd-2451545.0)+0.000387933*jc**2-jc**3/38710000.0+dpsi*np.cos(np.degrees(eps))
+    h = np.radians(nu+lon)-alpha
+    # parallax to topocentric position, the equatorial horizontal parallax and the topocentric declination
+    # are taken as in pysolar (parallax times R, axial distance in the denominator) to keep the same values
+    xi = np.radians(8.794*R/3600.0)
+    uf = np.arctan(0.99664719*np.tan(lat))
+    px = np.cos(uf)
+    py = 0.99664719*np.sin(uf)
+    dalpha = np.arctan2(-px*np.sin(xi)*np.sin(h),np.cos(delta)-px*np.sin(xi)*np.cos(h))
+    delta_t = np.arctan2((np.sin(delta)-py*np.sin(xi))*np.cos(dalpha),np.cos(delta)-py*np.sin(xi)*np.cos(h))
+    h_t = h-dalpha
+    # topocentric elevation, with refraction at 1013.25 mb and 25 C, and azimuth
+    e = np.degrees(np.arcsin(np.sin(lat)*np.sin(delta_t)+np.cos(lat)*np.cos(delta_t)*np.cos(h_t)))
+    refr = 1013.25*283.0*1.02/(1010.0*(25.0+273.15)*60.0*np.tan(np.radians(e+10.3/(e+5.11))))
+    sza = 90.0-(e+refr)
+    gamma = np.degrees(np.arctan2(np.sin(h_t),np.cos(h_t)*np.sin(lat)-np.tan(delta_t)*np.cos(lat)))
+    azi = -(gamma%360.0)
+    return sza,azi
+
+# periodic terms of the VSOP87 earth longitude (L), latitude (B) and radius vector (R) tables [A,B,C], as in pysolar
+# (the higher order tables L3-L5, R3-R4 change the position by about 1e-6 degree and are left out)
+_L0 = [[175347046.0,0.0,0.0],[3341656.0,4.6692568,6283.07585],[34894.0,4.6261,12566.1517],
+       [3497.0,2.7441,5753.3849],[3418.0,2.8289,3.5231],[3136.0,3.6277,77713.7715],
+       [2676.0,4.4181,7860.4194],[2343.0,6.1352,3930.2097],[1324.0,0.7425,11506.7698],
+       [1273.0,2.0371,529.691],[1199.0,1.1096,1577.3435],[990.0,5.233,5884.927],
+       [902.0,2.045,26.298],[857.0,3.508,398.149],[780.0,1.179,5223.694],
+       [753.0,2.533,5507.553],[505.0,4.583,18849.228],[492.0,4.205,775.523],
+       [357.0,2.92,0.067],[317.0,5.849,11790.629],[284.0,1.899,796.298],
+       [271.0,0.315,10977.079],[243.0,0.345,5486.778],[206.0,4.806,2544.314],
+       [205.0,1.869,5573.143],[202.0,2.4458,6069.777],[156.0,0.833,213.299],
+       [132.0,3.411,2942.463],[126.0,1.083,20.775],[115.0,0.645,0.98],
+       [103.0,0.636,4694.003],[102.0,0.976,15720.839],[102.0,4.267,7.114],
+       [99.0,6.21,2146.17],[98.0,0.68,155.42],[86.0,5.98,161000.69],
+       [85.0,1.3,6275.96],[85.0,3.67,71430.7],[80.0,1.81,17260.15],
+       [79.0,3.04,12036.46],[71.0,1.76,5088.63],[74.0,3.5,3154.69],
+       [74.0,4.68,801.82],[70.0,0.83,9437.76],[62.0,3.98,8827.39],
+       [61.0,1.82,7084.9],[57.0,2.78,6286.6],[56.0,4.39,14143.5],
+       [56.0,3.47,6279.55],[52.0,0.19,12139.55],[52.0,1.33,1748.02],
+       [51.0,0.28,5856.48],[49.0,0.49,1194.45],[41.0,5.37,8429.24],
+       [41.0,2.4,19651.05],[39.0,6.17,10447.39],[37.0,6.04,10213.29],
+       [37.0,2.57,1059.38],[36.0,1.71,2352.87],[36.0,1.78,6812.77],
+       [33.0,0.59,17789.85],[30.0,0.44,83996.85],[30.0,2.74,1349.87],
+       [25.0,3.16,4690.48]]
+_L1 = [[628331966747.0,0.0,0.0],[206059.0,2.678235,6283.07585],[4303.0,2.6351,12566.1517],
+       [425.0,1.59,3.523],[119.0,5.796,26.298],[109.0,2.966,1577.344],
+       [93.0,2.59,18849.23],[72.0,1.14,529.69],[68.0,1.87,398.15],
+       [67.0,4.41,5507.55],[59.0,2.89,5223.69],[56.0,2.17,155.42],
+       [45.0,0.4,796.3],[36.0,0.47,775.52],[29.0,2.65,7.11],
+       [21.0,5.34,0.98],[19.0,1.85,5486.78],[19.0,4.97,213.3],
+       [17.0,2.99,6275.96],[16.0,0.03,2544.31],[16.0,1.43,2146.17],
+       [15.0,1.21,10977.08],[12.0,2.83,1748.02],[12.0,3.26,5088.63],
+       [12.0,5.27,1194.45],[12.0,2.08,4694.0],[11.0,0.77,553.57],
+       [10.0,1.3,3286.6],[10.0,4.24,1349.87],[9.0,2.7,242.73],
+       [9.0,5.64,951.72],[8.0,5.3,2352.87],[6.0,2.65,9437.76],
+       [6.0,4.67,4690.48]]
+_L2 = [[52919.0,0.0,0.0],[8720.0,1.0721,6283.0758],[309.0,0.867,12566.152],
+       [27.0,0.05,3.52],[16.0,5.19,26.3],[16.0,3.68,155.42],
+       [10.0,0.76,18849.23],[9.0,2.06,77713.77],[7.0,0.83,775.52],
+       [5.0,4.66,1577.34],[4.0,1.03,7.11],[4.0,3.44,5573.14],
+       [3.0,5.14,796.3],[3.0,6.05,5507.55],[3.0,1.19,242.73],
+       [3.0,6.12,529.69],[3.0,0.31,398.15],[3.0,2.28,553.57],
+       [2.0,4.38,5223.69],[2.0,3.75,0.98]]
+_B0 = [[280.0,3.199,84334.662],[102.0,5.422,5507.553],[80.0,3.88,5223.69],
+       [44.0,3.7,2352.87],[32.0,4.0,1577.34]]
+_B1 = [[9.0,3.9,5507.55],[6.0,1.73,5223.69]]
+_R0 = [[100013989.0,0.0,0.0],[1670700.0,3.0984635,6283.07585],[13956.0,3.05525,12566.1517],
+       [3084.0,5.1985,77713.7715],[1628.0,1.1739,5753.3849],[1576.0,2.8469,7860.4194],
+       [925.0,5.453,11506.77],[542.0,4.564,3930.21],[472.0,3.661,5884.927],
+       [346.0,0.964,5507.553],[329.0,5.9,5223.694],[307.0,0.299,5573.143],
+       [243.0,4.273,11790.629],[212.0,5.847,1577.344],[186.0,5.022,10977.079],
+       [175.0,3.012,18849.228],[110.0,5.055,5486.778],[98.0,0.89,6069.78],
+       [86.0,5.69,15720.84],[86.0,1.27,161000.69],[85.0,0.27,17260.15],
+       [63.0,0.92,529.69],[57.0,2.01,83996.85],[56.0,5.24,71430.7],
+       [49.0,3.25,2544.31],[47.0,2.58,775.52],[45.0,5.54,9437.76],
+       [43.0,6.01,6275.96],[39.0,5.36,4694.0],[38.0,2.39,8827.39],
+       [37.0,0.83,19651.05],[37.0,4.9,12139.55],[36.0,1.67,12036.46],
+       [35.0,1.84,2942.46],[33.0,0.24,7084.9],[32.0,0.18,5088.63],
+       [32.0,1.78,398.15],[28.0,1.21,6286.6],[28.0,1.9,6279.55],
+       [26.0,4.59,10447.39]]
+_R1 = [[103019.0,1.10749,6283.07585],[1721.0,1.0644,12566.1517],[702.0,3.142,0.0],
+       [32.0,1.02,18849.23],[31.0,2.84,5507.55],[25.0,1.32,5223.69],
+       [18.0,1.42,1577.34],[10.0,5.91,10977.08],[9.0,1.42,6275.96],
+       [9.0,0.27,5486.78]]
+_R2 = [[4359.0,5.7846,6283.0758],[124.0,5.579,12566.152],[12.0,3.14,0.0],
+       [9.0,3.63,77713.77],[6.0,1.87,5573.14],[3.0,5.47,18849.0]]
+# terms of the nutation, multiples of the moon and sun arguments and coefficients [a,b,c,d]
+_nutation_args = [[0,0,0,0,1],[-2,0,0,2,2],[0,0,0,2,2],[0,0,0,0,2],[0,1,0,0,0],[0,0,1,0,0],
+                  [-2,1,0,2,2],[0,0,0,2,1],[0,0,1,2,2],[-2,-1,0,2,2],[-2,0,1,0,0],[-2,0,0,2,1],
+                  [0,0,-1,2,2],[2,0,0,0,0],[0,0,1,0,1],[2,0,-1,2,2],[0,0,-1,0,1],[0,0,1,2,1],
+                  [-2,0,2,0,0],[0,0,-2,2,1],[2,0,0,2,2],[0,0,2,2,2],[0,0,2,0,0],[-2,0,1,2,2],
+                  [0,0,0,2,0],[-2,0,0,2,0],[0,0,-1,2,1],[0,2,0,0,0],[2,0,-1,0,1],[-2,2,0,2,2],
+                  [0,1,0,0,1],[-2,0,1,0,1],[0,-1,0,0,1],[0,0,2,-2,0],[2,0,-1,2,1],[2,0,1,2,2],
+                  [0,1,0,2,2],[-2,1,1,0,0],[0,-1,0,2,2],[2,0,0,2,1],[2,0,1,0,0],[-2,0,2,2,2],
+                  [-2,0,1,2,1],[2,0,-2,0,1],[2,0,0,0,1],[0,-1,1,0,0],[-2,-1,0,2,1],[-2,0,0,0,1],
+                  [0,0,2,2,1],[-2,0,2,0,1],[-2,1,0,2,1],[0,0,1,-2,0],[-1,0,1,0,0],[-2,1,0,0,0],
+                  [1,0,0,0,0],[0,0,1,2,0],[0,0,-2,2,2],[-1,-1,1,0,0],[0,1,1,0,0],[0,-1,1,2,2],
+                  [2,-1,-1,2,2],[0,0,3,2,2],[2,-1,0,2,2]]
+_nutation_coefs = [[-171996.0,-174.2,92025.0,8.9],[-13187.0,-1.6,5736.0,-3.1],[-2274.0,-0.2,977.0,-0.5],[2062.0,0.2,-895.0,0.5],
+                   [1426.0,-3.4,54.0,-0.1],[712.0,0.1,-7.0,0.0],[-517.0,1.2,224.0,-0.6],[-386.0,-0.4,200.0,0.0],
+                   [-301.0,0.0,129.0,-0.1],[217.0,-0.5,-95.0,0.3],[-158.0,0.0,0.0,0.0],[129.0,0.1,-70.0,0.0],
+                   [123.0,0.0,-53.0,0.0],[63.0,0.0,0.0,0.0],[63.0,0.1,-33.0,0.0],[-59.0,0.0,26.0,0.0],
+                   [-58.0,-0.1,32.0,0.0],[-51.0,0.0,27.0,0.0],[48.0,0.0,0.0,0.0],[46.0,0.0,-24.0,0.0],
+                   [-38.0,0.0,16.0,0.0],[-31.0,0.0,13.0,0.0],[29.0,0.0,0.0,0.0],[29.0,0.0,-12.0,0.0],
+                   [26.0,0.0,0.0,0.0],[-22.0,0.0,0.0,0.0],[21.0,0.0,-10.0,0.0],[17.0,-0.1,0.0,0.0],
+                   [16.0,0.0,-8.0,0.0],[-16.0,0.1,7.0,0.0],[-15.0,0.0,9.0,0.0],[-13.0,0.0,7.0,0.0],
+                   [-12.0,0.0,6.0,0.0],[11.0,0.0,0.0,0.0],[-10.0,0.0,5.0,0.0],[-8.0,0.0,3.0,0.0],
+                   [7.0,0.0,-3.0,0.0],[-7.0,0.0,0.0,0.0],[-7.0,0.0,3.0,0.0],[-7.0,0.0,3.0,0.0],
+                   [6.0,0.0,0.0,0.0],[6.0,0.0,-3.0,0.0],[6.0,0.0,-3.0,0.0],[-6.0,0.0,3.0,0.0],
+                   [-6.0,0.0,3.0,0.0],[5.0,0.0,0.0,0.0],[-5.0,0.0,3.0,0.0],[-5.0,0.0,3.0,0.0],
+                   [-5.0,0.0,3.0,0.0],[4.0,0.0,0.0,0.0],[4.0,0.0,0.0,0.0],[4.0,0.0,0.0,0.0],
+                   [-4.0,0.0,0.0,0.0],[-4.0,0.0,0.0,0.0],[-4.0,0.0,0.0,0.0],[3.0,0.0,0.0,0.0],
+                   [-3.0,0.0,0.0,0.0],[-3.0,0.0,0.0,0.0],[-3.0,0.0,0.0,0.0],[-3.0,0.0,0.0,0.0],
+                   [-3.0,0.0,0.0,0.0],[-3.0,0.0,0.0,0.0],[-3.0,0.0,0.0,0.0]]
+
+
+# In[1]:
+
+def get_sza_azi_pysolar(lat,lon,datetime):
     """
     Program wrapper for pysolar to get the solar zenith angle and the solar azimuth angle
     can use inputs of list or numpy arrays
@@ -373,5 +594,199 @@ def mplot_spec(m,lon,lat,*args,**kwargs):
         if c[-1] != len(lon)-1: c = np.append(c,c[-1]+1)
         x,y = m(lon[c],lat[c])
         lines.append(m.plot(x,y,*args,**kwargs))
-    return lines  
+    return lines
+
 
+# In[ ]:
+
+def sgp4_init(tle1,tle2):
+    """
+    Purpose:
+        Read the two line elements of multiple satellites and initialize the SGP4 constants, as numpy arrays
+        Follows the near earth part of the SGP4 model (Vallado et al., 2006, 'Revisiting Spacetrack Report #3'), WGS72 constants
+    Inputs:
+        tle1: list of the first lines of the two line elements
+        tle2: list of the second lines, same size as tle1
+    Outputs:
+        dictionary of the element and constant arrays (one value per satellite)
+        'deep' is True for the satellites with a period of 225 minutes or more, not handled by sgp4_latlon
+    Dependencies:
+        numpy
+    Example:
+        el = sgp4_init([sat['tle1']],[sat['tle2']])
+    """
+    import numpy as np
+    re,j2,j3,j4 = 6378.135,0.001082616,-0.00000253881,-0.00000165597
+    xke = 60.0/np.sqrt(re**3/398600.8)
+    j3oj2 = j3/j2
+    yr = np.array([int(l[18:20]) for l in tle1])
+    yr = np.where(yr<57,yr+2000,yr+1900)
+    # julian day of january first of the epoch year
+    jd0 = 367.0*yr-np.floor(7.0*(yr+np.floor(10.0/12.0))*0.25)+np.floor(275.0/9.0)+1721014.5
+    e = {'re':re,'xke':xke,'j2':j2,
+         'epoch':jd0+np.array([float(l[20:32]) for l in tle1])-1.0,
+         'bstar':np.array([float(l[53]+'.'+l[54:59])*10.0**int(l[59:61]) for l in tle1]),
+         'inclo':np.radians([float(l[8:16]) for l in tle2]),
+         'nodeo':np.radians([float(l[17:25]) for l in tle2]),
+         'ecco':np.array([float('0.'+l[26:33].strip()) for l in tle2]),
+         'argpo':np.radians([float(l[34:42]) for l in tle2]),
+         'mo':np.radians([float(l[43:51]) for l in tle2])}
+    no = np.array([float(l[52:63]) for l in tle2])*2.0*np.pi/1440.0
+    ecco,inclo,bstar,argpo = e['ecco'],e['inclo'],e['bstar'],e['argpo']
+    # recover the original mean motion and semi-major axis
+    omeosq = 1.0-ecco**2
+    rteosq = np.sqrt(omeosq)
+    cosio = np.cos(inclo)
+    cosio2 = cosio**2
+    ak = (xke/no)**(2.0/3.0)
+    d1 = 0.75*j2*(3.0*cosio2-1.0)/(rteosq*omeosq)
+    dl = d1/ak**2
+    adel = ak*(1.0-dl**2-dl*(1.0/3.0+134.0*dl**2/81.0))
+    no = no/(1.0+d1/adel**2)
+    ao = (xke/no)**(2.0/3.0)
+    sinio = np.sin(inclo)
+    po = ao*omeosq
+    con42 = 1.0-5.0*cosio2
+    con41 = -con42-2.0*cosio2
+    posq = po**2
+    rp = ao*(1.0-ecco)
+    e['deep'] = 2.0*np.pi/no>=225.0
+    # drag and secular terms
+    isimp = rp<220.0/re+1.0
+    perige = (rp-1.0)*re
+    sfour = np.where(perige<156.0,np.where(perige<98.0,20.0,perige-78.0),78.0)
+    qzms24 = ((120.0-sfour)/re)**4
+    sfour = sfour/re+1.0
+    pinvsq = 1.0/posq
+    tsi = 1.0/(ao-sfour)
+    eta = ao*ecco*tsi
+    etasq = eta**2
+    eeta = ecco*eta
+    psisq = np.abs(1.0-etasq)
+    coef = qzms24*tsi**4
+    coef1 = coef/psisq**3.5
+    cc2 = coef1*no*(ao*(1.0+1.5*etasq+eeta*(4.0+etasq))+0.375*j2*tsi/psisq*con41*(8.0+3.0*etasq*(8.0+etasq)))
+    cc1 = bstar*cc2
+    high_e = ecco>1.0E-4
+    cc3 = np.where(high_e,-2.0*coef*tsi*j3oj2*no*sinio/np.where(high_e,ecco,1.0),0.0)
+    x1mth2 = 1.0-cosio2
+    cc4 = 2.0*no*coef1*ao*omeosq*(eta*(2.0+0.5*etasq)+ecco*(0.5+2.0*etasq)-j2*tsi/(ao*psisq)*
+          (-3.0*con41*(1.0-2.0*eeta+etasq*(1.5-0.5*eeta))+0.75*x1mth2*(2.0*etasq-eeta*(1.0+etasq))*np.cos(2.0*argpo)))
+    cc5 = 2.0*coef1*ao*omeosq*(1.0+2.75*(etasq+eeta)+eeta*etasq)
+    cosio4 = cosio2**2
+    temp1 = 1.5*j2*pinvsq*no
+    temp2 = 0.5*temp1*j2*pinvsq
+    temp3 = -0.46875*j4*pinvsq**2*no
+    xhdot1 = -temp1*cosio
+    e.update({'no':no,'eta':eta,'cc1':cc1,'cc4':cc4,'cc5':cc5,'con41':con41,'x1mth2':x1mth2,
+              'x7thm1':7.0*cosio2-1.0,'isimp':isimp,
+              'mdot':no+0.5*temp1*rteosq*con41+0.0625*temp2*rteosq*(13.0-78.0*cosio2+137.0*cosio4),
+              'argpdot':-0.5*temp1*con42+0.0625*temp2*(7.0-114.0*cosio2+395.0*cosio4)+temp3*(3.0-36.0*cosio2+49.0*cosio4),
+              'nodedot':xhdot1+(0.5*temp2*(4.0-19.0*cosio2)+2.0*temp3*(3.0-7.0*cosio2))*cosio,
+              'omgcof':bstar*cc3*np.cos(argpo),
+              'xmcof':np.where(high_e,-2.0/3.0*coef*bstar/np.where(high_e,eeta,1.0),0.0),
+              'nodecf':3.5*omeosq*xhdot1*cc1,
+              't2cof':1.5*cc1,
+              'xlcof':-0.25*j3oj2*sinio*(3.0+5.0*cosio)/np.where(np.abs(cosio+1.0)>1.5E-12,1.0+cosio,1.5E-12),
+              'aycof':-0.5*j3oj2*sinio,
+              'delmo':(1.0+eta*np.cos(e['mo']))**3,
+              'sinmao':np.sin(e['mo'])})
+    # higher order drag terms, not used for the satellites with very low perigee
+    cc1sq = cc1**2
+    d2 = 4.0*ao*tsi*cc1sq
+    temp = d2*tsi*cc1/3.0
+    d3 = (17.0*ao+sfour)*temp
+    d4 = 0.5*temp*ao*tsi*(221.0*ao+31.0*sfour)*cc1
+    e.update({'d2':d2,'d3':d3,'d4':d4,'t3cof':d2+2.0*cc1sq,'t4cof':0.25*(3.0*d3+cc1*(12.0*d2+10.0*cc1sq)),
+              't5cof':0.2*(3.0*d4+12.0*cc1*d3+6.0*d2**2+15.0*cc1sq*(2.0*d2+cc1sq))})
+    return e
+
+
+# In[ ]:
+
+def sgp4_latlon(tle1,tle2,jd):
+    """
+    Purpose:
+        Propagate multiple satellites with SGP4 for all times at once, and return the sub-satellite points
+        Vectorized in numpy on satellites and times, replacing calls to ephem's compute at each time step
+    Inputs:
+        tle1: list of the first lines of the two line elements
+        tle2: list of the second lines, same size as tle1
+        jd: array of times, in julian days (UT)
+    Outputs:
+        lat: geocentric latitude of the sub-satellite points (degrees, as ephem's sublat), array of size number of satellites by number of times
+        lon: longitude of the sub-satellite points (degrees, -180 to 180), same size as lat
+        deep space satellites (period of 225 minutes or more) are returned as NaN
+    Dependencies:
+        numpy
+        sgp4_init
+    Example:
+        lat,lon = sgp4_latlon([tle1],[tle2],2457289.5+np.arange(2881)/2880.0)
+    """
+    import numpy as np
+    e = sgp4_init(tle1,tle2)
+    jd = np.asarray(jd,dtype=float)
+    c = lambda k: e[k][:,np.newaxis]
+    t = (jd[np.newaxis,:]-c('epoch'))*1440.0
+    xmdf = c('mo')+c('mdot')*t
+    argpdf = c('argpo')+c('argpdot')*t
+    nodedf = c('nodeo')+c('nodedot')*t
+    t2 = t**2
+    nodem = nodedf+c('nodecf')*t2
+    full = ~c('isimp')
+    delm = c('xmcof')*((1.0+c('eta')*np.cos(xmdf))**3-c('delmo'))
+    temp = np.where(full,c('omgcof')*t+delm,0.0)
+    mm = xmdf+temp
+    argpm = argpdf-temp
+    tempa = 1.0-c('cc1')*t-np.where(full,c('d2')*t2+c('d3')*t2*t+c('d4')*t2**2,0.0)
+    tempe = c('bstar')*c('cc4')*t+np.where(full,c('bstar')*c('cc5')*(np.sin(mm)-c('sinmao')),0.0)
+    templ = c('t2cof')*t2+np.where(full,c('t3cof')*t2*t+t2**2*(c('t4cof')+t*c('t5cof')),0.0)
+    am = (e['xke']/c('no'))**(2.0/3.0)*tempa**2
+    em = np.maximum(c('ecco')-tempe,1.0E-6)
+    mm = mm+c('no')*templ
+    # long period periodics
+    axnl = em*np.cos(argpm)
+    temp = 1.0/(am*(1.0-em**2))
+    aynl = em*np.sin(argpm)+temp*c('aycof')
+    xl = mm+argpm+nodem+temp*c('xlcof')*axnl
+    # solve kepler's equation
+    u = np.mod(xl-nodem,2.0*np.pi)
+    eo1 = u
+    for i in xrange(10):
+        tem5 = (u-aynl*np.cos(eo1)+axnl*np.sin(eo1)-eo1)/(1.0-np.cos(eo1)*axnl-np.sin(eo1)*aynl)
+        eo1 = eo1+np.clip(tem5,-0.95,0.95)
+        if np.abs(tem5).max()<1.0E-12:
+            break
+    sineo1,coseo1 = np.sin(eo1),np.cos(eo1)
+    # short period periodics
+    ecose = axnl*coseo1+aynl*sineo1
+    esine = axnl*sineo1-aynl*coseo1
+    el2 = axnl**2+aynl**2
+    pl = am*(1.0-el2)
+    rl = am*(1.0-ecose)
+    betal = np.sqrt(1.0-el2)
+    temp = esine/(1.0+betal)
+    sinu = am/rl*(sineo1-aynl-axnl*temp)
+    cosu = am/rl*(coseo1-axnl+aynl*temp)
+    su = np.arctan2(sinu,cosu)
+    sin2u = 2.0*cosu*sinu
+    cos2u = 1.0-2.0*sinu**2
+    temp1 = 0.5*e['j2']/pl
+    temp2 = temp1/pl
+    mrt = rl*(1.0-1.5*temp2*betal*c('con41'))+0.5*temp1*c('x1mth2')*cos2u
+    su = su-0.25*temp2*c('x7thm1')*sin2u
+    xnode = nodem+1.5*temp2*np.cos(c('inclo'))*sin2u
+    xinc = c('inclo')+1.5*temp2*np.cos(c('inclo'))*np.sin(c('inclo'))*cos2u
+    # position in the true equator mean equinox frame, then rotated to earth fixed with the greenwich sidereal time
+    cosi = np.cos(xinc)
+    x = mrt*(-np.sin(xnode)*cosi*np.sin(su)+np.cos(xnode)*np.cos(su))
+    y = mrt*(np.cos(xnode)*cosi*np.sin(su)+np.sin(xnode)*np.cos(su))
+    z = mrt*np.sin(xinc)*np.sin(su)
+    tut1 = (jd-2451545.0)/36525.0
+    gst = np.radians((-6.2E-6*tut1**3+0.093104*tut1**2+(876600.0*3600.0+8640184.812866)*tut1+67310.54841)/240.0)
+    lon = np.degrees(np.arctan2(y,x)-gst[np.newaxis,:])
+    lon = (lon+180.0)%360.0-180.0
+    lat = np.degrees(np.arctan2(z,np.sqrt(x**2+y**2)))
+    lat[e['deep'],:] = np.nan
+    lon[e['deep'],:] = np.nan
+    return lat,lon